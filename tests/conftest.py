@@ -0,0 +1,114 @@
+import itertools
+import threading
+
+import pytest
+import vmtconnect as vc
+
+
+
+VERSION = {
+    'versionInfo': 'Turbonomic Operations Manager 7.22.0 (Build "20200101") "2020-01-01"\n',
+    'version': '7.22.0',
+    'build': '1',
+    'branch': '7.22.0',
+    'marketVersion': 2
+}
+
+
+class FakeConnection(vc.Connection):
+    # minimal in-memory server, markets succeed after a number of polls, polls
+    # listed in drop raise a connection error; market and scenario listings are
+    # paged by page_size unless fetch_all is given
+    def __init__(self, polls=2, drop=(), page_size=None):
+        self._Connection__version = vc.Version(VERSION)
+        self.host = 'fake'
+        self.ready_after = polls
+        self.drop = set(drop)
+        self.page_size = page_size
+        self.polls = 0
+        self.markets = {}
+        self.scenarios = {}
+        self.calls = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def request(self, path, method='GET', query='', dto=None, **kwargs):
+        return self._request(path, method, query, dto, **kwargs)
+
+    def __page(self, items, kwargs):
+        if self.page_size and not kwargs.get('fetch_all'):
+            return items[:self.page_size]
+
+        return items
+
+    def __poll(self, market):
+        market['polls'] += 1
+
+        if market['state'] == 'RUNNING' and market['polls'] > self.ready_after:
+            market['state'] = 'SUCCEEDED'
+
+        return dict(market)
+
+    def _request(self, path, method='GET', query='', dto=None, **kwargs):
+        uuid = kwargs.get('uuid')
+
+        with self.lock:
+            self.calls.append((method, path, uuid))
+
+        if path == 'users':
+            return [{'username': 'test'}]
+
+        if path == 'search':
+            return [{'uuid': 'c1'}, {'uuid': 'c2'}]
+
+        if path.startswith('scenarios') and method == 'POST':
+            i = f's{next(self.ids)}'
+            self.scenarios[i] = {'uuid': i, 'displayName': f'CUSTOM_{i}', 'dto': dto}
+            return [{'uuid': i, 'displayName': i}]
+
+        if path == 'scenarios' and method == 'PUT':
+            self.scenarios[uuid]['dto'] = dto
+            return [{'uuid': uuid, 'displayName': uuid}]
+
+        if path == 'scenarios' and method == 'GET':
+            return self.__page([dict(x) for x in self.scenarios.values()], kwargs)
+
+        if path == 'scenarios' and method == 'DELETE':
+            self.scenarios.pop(uuid, None)
+            return True
+
+        if path.endswith('/stats'):
+            return [{'statistics': []}]
+
+        if path.startswith('markets/') and method == 'POST':
+            i = f'm{next(self.ids)}'
+            self.markets[i] = {'uuid': i, 'displayName': f'CUSTOM_{i}', 'state': 'RUNNING',
+                               'polls': 0, 'unplacedEntities': False,
+                               'scenario': {'uuid': path.split('/')[-1]}}
+            return [dict(self.markets[i])]
+
+        if path == 'markets' and method == 'GET':
+            if uuid is None:
+                return self.__page([self.__poll(x) for x in self.markets.values()], kwargs)
+
+            self.polls += 1
+
+            if self.polls in self.drop:
+                raise vc.VMTConnectionError('connection dropped')
+
+            return [self.__poll(self.markets[uuid])]
+
+        if path == 'markets' and method == 'PUT':
+            self.markets[uuid]['state'] = 'STOPPED'
+            return [True]
+
+        if path == 'markets' and method == 'DELETE':
+            self.markets.pop(uuid, None)
+            return True
+
+        raise NotImplementedError(f'{method} {path}')
+
+
+@pytest.fixture
+def vmt():
+    return FakeConnection()
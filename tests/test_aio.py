@@ -0,0 +1,50 @@
+import asyncio
+
+import vmtplanner as vp
+from vmtplanner.aio import AsyncPlan
+from vmtplanner.context import PlanContext
+from vmtplanner.processors.headroom import AsyncClusterHeadroom, ClusterHeadroom
+
+
+
+def make_spec(name='test'):
+    spec = vp.PlanSpec(name, scope=['x'])
+    spec.poll_freq = 0.01
+
+    return spec
+
+
+def test_async_plan_copies_connection(vmt):
+    plan = AsyncPlan(vmt, make_spec())
+
+    assert plan._vmt is not vmt
+    assert plan.context is PlanContext.get(vmt)
+
+
+def test_async_plans_share_connection(vmt):
+    async def main():
+        plans = [AsyncPlan(vmt, make_spec(f'p{x}')) for x in range(5)]
+
+        return plans, await asyncio.gather(*(x.run() for x in plans))
+
+    plans, res = asyncio.run(main())
+
+    assert res == [vp.MarketState.SUCCEEDED] * 5
+    assert len({x.market_id for x in plans}) == 5
+
+
+def test_async_cluster_headroom_construction(vmt):
+    plan = AsyncClusterHeadroom(vmt, executor=None)
+
+    assert plan._vmt is not vmt
+    assert plan.context is PlanContext.get(vmt)
+    assert plan.spec.scope == ['c1', 'c2']
+    assert plan.market_name.startswith('Custom Headroom Plan')
+
+
+def test_cluster_headroom_accepts_plan_arguments(vmt):
+    ctx = PlanContext.get(vmt)
+    plan = ClusterHeadroom(vmt, context=ctx, name='headroom')
+
+    assert plan.context is ctx
+    assert plan.market_name == 'headroom'
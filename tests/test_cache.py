@@ -0,0 +1,70 @@
+import pytest
+
+import vmtplanner as vp
+from vmtplanner.cache import ResultCache
+from vmtplanner.pool import PlanPool
+
+
+
+def make_plan(conn, cache, scope='x'):
+    spec = vp.PlanSpec('test', scope=[scope])
+    spec.poll_freq = 0.01
+    plan = vp.Plan(conn, spec)
+    plan.result_cache = cache
+
+    return plan
+
+
+def test_cache_hit_does_not_own_previous_market(vmt):
+    cache = ResultCache()
+    plan = make_plan(vmt, cache)
+    first = make_plan(vmt, cache)
+
+    assert plan.run() == vp.MarketState.SUCCEEDED
+    market = plan.market_id
+    assert first.run() == vp.MarketState.SUCCEEDED
+    assert first.cached
+
+    # a rerun served from the cache releases the market of the previous run
+    assert plan.run() == vp.MarketState.SUCCEEDED
+    assert plan.cached
+    assert plan.market_id is None
+    assert not plan.initialized
+    assert plan.is_complete()
+    assert plan.get_stats() == [{'statistics': []}]
+
+    with pytest.raises(vp.InvalidMarketError):
+        plan.delete()
+
+    assert market in vmt.markets
+
+
+def test_pool_cleanup_skips_cached_plans(vmt):
+    cache = ResultCache()
+    plan = make_plan(vmt, cache)
+    plan.run()
+    market = plan.market_id
+
+    with PlanPool(cleanup=True) as pool:
+        res = pool.submit(plan=plan).result()
+
+    assert res.error is None
+    assert plan.cached
+    assert market in vmt.markets
+
+
+def test_result_cache_is_bounded(vmt):
+    cache = ResultCache(max_entries=2)
+    plans = [make_plan(vmt, cache, f'x{x}') for x in range(3)]
+
+    for x in plans[:2]:
+        x.run()
+
+    # refreshes the first result, the second is the least recently used
+    assert cache.get(plans[0]) is not None
+
+    plans[2].run()
+
+    assert len(cache) == 2
+    assert cache.get(plans[0]) is not None
+    assert cache.get(plans[1]) is None
@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+import vmtplanner as vp
+from vmtplanner.collector import MarketCollector
+
+from conftest import FakeConnection
+
+
+
+OLD = '2020-01-01T00:00:00+0000'
+
+
+def add_market(conn, uuid, name, state='SUCCEEDED', scenario=None, **kwargs):
+    conn.markets[uuid] = {'uuid': uuid, 'displayName': name, 'state': state,
+                          'polls': 0, 'scenario': {'uuid': scenario or f's_{uuid}'},
+                          **kwargs}
+
+
+@pytest.fixture
+def conn():
+    conn = FakeConnection()
+    add_market(conn, 'Market', 'Market')
+    conn.markets['Market']['uuid'] = '_realtime'
+
+    return conn
+
+
+def test_selects_finished_prefixed_markets(conn):
+    add_market(conn, 'a', 'CUSTOM_a', runDate=OLD)
+    add_market(conn, 'b', 'CUSTOM_b', state='RUNNING', runDate=OLD)
+    add_market(conn, 'c', 'other', runDate=OLD)
+    add_market(conn, 'd', 'Custom Headroom Plan d', state='STOPPED', runDate=OLD)
+    add_market(conn, 'e', 'CUSTOM_e', runDate=time.strftime('%Y-%m-%dT%H:%M:%S+0000', time.gmtime()))
+
+    res = MarketCollector(conn).find_markets()
+
+    assert sorted(x['uuid'] for x in res) == ['a', 'd']
+
+
+def test_market_without_run_date_is_aged_by_name(conn):
+    old = int(time.time()) - 7200
+    add_market(conn, 'a', f'CUSTOM_test_{old}_abcd1234', state='STOPPED')
+    add_market(conn, 'b', f'Custom Headroom Plan {old} abcd1234', state='STOPPED')
+    add_market(conn, 'c', f'CUSTOM_test_{int(time.time())}_abcd1234', state='STOPPED')
+
+    res = MarketCollector(conn).collect()
+
+    assert sorted(res.markets) == ['a', 'b']
+    assert sorted(conn.markets) == ['Market', 'c']
+
+
+def test_market_without_any_date_is_aged_from_first_seen(conn):
+    add_market(conn, 'a', 'CUSTOM_a', state='STOPPED')
+    gc = MarketCollector(conn, min_age=0.05)
+
+    assert gc.find_markets() == []
+
+    time.sleep(0.1)
+
+    assert [x['uuid'] for x in gc.find_markets()] == ['a']
+
+
+def test_collect_requires_min_age(conn):
+    add_market(conn, 'a', 'CUSTOM_a', runDate=OLD)
+    gc = MarketCollector(conn, min_age=0)
+
+    with pytest.raises(ValueError):
+        gc.collect()
+
+    assert gc.collect(dry_run=True).markets == ['a']
+    assert 'a' in conn.markets
+
+
+def test_shared_and_orphan_scenarios(conn):
+    add_market(conn, 'a', 'CUSTOM_a', runDate=OLD, scenario='s1')
+    add_market(conn, 'b', 'CUSTOM_b', state='RUNNING', runDate=OLD, scenario='s1')
+    add_market(conn, 'c', 'CUSTOM_c', runDate=OLD, scenario='s2')
+    conn.scenarios['s3'] = {'uuid': 's3', 'displayName': 'CUSTOM_s3'}
+
+    assert MarketCollector(conn).find_scenarios() == ['s2']
+    assert MarketCollector(conn, orphans=True).find_scenarios() == ['s2', 's3']
+
+
+def test_all_pages_are_collected():
+    conn = FakeConnection(page_size=1)
+    add_market(conn, 'Market', 'Market')
+
+    for x in 'abc':
+        add_market(conn, x, f'CUSTOM_{x}', runDate=OLD)
+
+    res = MarketCollector(conn).collect()
+
+    assert sorted(res.markets) == ['a', 'b', 'c']
+
+
+def test_system_market_is_protected(conn):
+    add_market(conn, 'x', 'CUSTOM_x', runDate=OLD)
+    conn.markets['x']['uuid'] = '_realtime'
+    gc = MarketCollector(conn, min_age=0)
+
+    assert gc.find_markets() == []
+
+    with pytest.raises(vp.InvalidMarketError):
+        gc.remove(['_realtime'])
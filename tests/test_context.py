@@ -0,0 +1,50 @@
+import gc
+import weakref
+
+import vmtplanner as vp
+from vmtplanner.context import PlanContext
+
+from conftest import FakeConnection
+
+
+
+def test_context_is_shared_per_connection(vmt):
+    assert PlanContext.get(vmt) is PlanContext.get(vmt)
+    assert PlanContext.get(vmt) is not PlanContext.get(FakeConnection())
+
+
+def test_context_caches_user(vmt):
+    ctx = PlanContext.get(vmt)
+
+    assert ctx.user == 'test'
+    assert ctx.user == 'test'
+    assert vmt.calls.count(('GET', 'users', 'me')) == 1
+
+
+def test_connection_is_released():
+    conn = FakeConnection()
+    ctx = weakref.ref(PlanContext.get(conn))
+    plan = vp.Plan(conn, vp.PlanSpec('test', scope=['x']))
+    ref = weakref.ref(conn)
+
+    del conn, plan
+    gc.collect()
+
+    assert ref() is None
+    assert ctx() is None
+
+
+def test_copy_connection_shares_context():
+    conn = FakeConnection()
+    copy = PlanContext.copy_connection(conn)
+
+    assert copy is not conn
+    assert PlanContext.get(copy) is PlanContext.get(conn)
+
+    # the context remains usable through the copy
+    ref = weakref.ref(conn)
+    del conn
+    gc.collect()
+
+    assert ref() is None
+    assert PlanContext.get(copy).user == 'test'
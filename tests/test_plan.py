@@ -0,0 +1,30 @@
+import pytest
+
+import vmtplanner as vp
+from vmtplanner.context import PlanContext
+
+
+
+def make_spec(name='test'):
+    spec = vp.PlanSpec(name, scope=['x'])
+    spec.poll_freq = 0.01
+
+    return spec
+
+
+def test_submit_runs_on_connection_copy(vmt):
+    plan = vp.Plan(vmt, make_spec())
+    future = plan.submit()
+
+    assert future.result() == vp.MarketState.SUCCEEDED
+    assert plan._vmt is not vmt
+    assert plan.context is PlanContext.get(vmt)
+
+
+def test_submit_while_running_fails_in_future(vmt):
+    vmt.ready_after = 20
+    plan = vp.Plan(vmt, make_spec())
+    futures = [plan.submit(), plan.submit()]
+    errors = [type(x.exception()) for x in futures]
+
+    assert sorted(errors, key=str) == sorted([type(None), vp.PlanRunning], key=str)
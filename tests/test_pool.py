@@ -0,0 +1,53 @@
+import vmtplanner as vp
+from vmtplanner.capacity import CapacitySearch
+from vmtplanner.context import PlanContext
+from vmtplanner.pool import PlanPool, PlanPoller, run_many
+from vmtplanner.processors.headroom import ClusterHeadroom
+from vmtplanner.sweep import ParameterSweep
+
+
+
+def make_spec(name='test'):
+    spec = vp.PlanSpec(name, scope=['x'])
+    spec.poll_freq = 0.01
+
+    return spec
+
+
+def test_pool_copies_connection(vmt):
+    res = run_many([(vmt, make_spec(f'p{x}')) for x in range(4)], max_markets=2)
+
+    assert [x.error for x in res] == [None] * 4
+    assert all(x.plan._vmt is not vmt for x in res)
+    assert all(x.plan.context is PlanContext.get(vmt) for x in res)
+
+
+def test_pool_plan_class_without_context(vmt):
+    spec = make_spec()
+    spec.type = vp.PlanType.OPTIMIZE_ONPREM
+
+    with PlanPool(max_markets=1, plan_class=ClusterHeadroom) as pool:
+        plan = pool.submit(vmt, spec).result().plan
+
+    assert isinstance(plan, ClusterHeadroom)
+
+
+def test_sweep_and_capacity_construct_plans(vmt):
+    sweep = ParameterSweep(vmt, make_spec(), max_markets=2)
+    sweep.axis('count', [1, 2], lambda s, v: s.change_entity(vp.EntityAction.ADD, ['tpl'], count=v))
+
+    assert sorted(x.params['count'] for x in sweep.run() if x.error is None) == [1, 2]
+
+    search = CapacitySearch(vmt, make_spec(), 'tpl', start=4, max_count=8)
+
+    assert search.search().count == 8
+
+
+def test_poller_sees_markets_beyond_first_page(vmt):
+    vmt.page_size = 1
+    poller = PlanPoller(vmt, interval=0.01)
+    res = run_many([(vmt, make_spec(f'p{x}')) for x in range(3)], max_markets=3,
+                   poller=poller)
+
+    assert [x.error for x in res] == [None] * 3
+    assert [x.state for x in res] == [vp.MarketState.SUCCEEDED] * 3
@@ -0,0 +1,50 @@
+import pytest
+
+import vmtplanner as vp
+from vmtplanner.retry import RetryPolicy
+
+from conftest import FakeConnection
+
+
+
+def make_plan(conn, **kwargs):
+    spec = vp.PlanSpec('test', scope=['x'])
+    spec.poll_freq = 0.01
+    plan = vp.Plan(conn, spec)
+    plan.retry_policy = RetryPolicy(backoff=0, jitter=0, **kwargs)
+
+    return plan
+
+
+def test_connection_error_mid_poll_is_retried():
+    conn = FakeConnection(drop=[2])
+    plan = make_plan(conn)
+
+    assert plan.run() == vp.MarketState.SUCCEEDED
+    assert len(conn.markets) == 1
+
+
+def test_connection_lost_abandons_market():
+    conn = FakeConnection(drop=range(2, 100))
+    plan = make_plan(conn, max_retry=2, stage_retry=2)
+
+    with pytest.raises(vp.PlanError):
+        plan.run()
+
+    assert [x.error is not None for x in plan.metrics.attempts] == [True, True]
+    assert conn.markets == {}
+
+
+def test_failed_rerun_does_not_return_previous_result():
+    conn = FakeConnection()
+    plan = make_plan(conn, max_retry=2, stage_retry=1)
+    plan.incremental = True
+
+    assert plan.run() == vp.MarketState.SUCCEEDED
+
+    conn.drop = set(range(conn.polls + 1, 100))
+
+    with pytest.raises(vp.PlanError):
+        plan.run()
+
+    assert plan.result is None
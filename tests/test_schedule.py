@@ -0,0 +1,73 @@
+import json
+import math
+import time
+
+import vmtplanner as vp
+from vmtplanner.schedule import AdaptivePollSchedule
+
+from conftest import FakeConnection
+
+
+
+class QueuedConnection(FakeConnection):
+    # new markets wait in the server queue before running
+    def __init__(self, queued=0.2, **kwargs):
+        super().__init__(**kwargs)
+        self.queued = queued
+        self.created = {}
+
+    def _request(self, path, method='GET', query='', dto=None, **kwargs):
+        uuid = kwargs.get('uuid')
+
+        if path == 'markets' and method == 'GET' and uuid in self.created \
+           and time.monotonic() - self.created[uuid] > self.queued:
+            self.markets[uuid]['state'] = 'RUNNING'
+            self.markets[uuid]['polls'] = 0
+            del self.created[uuid]
+
+        res = super()._request(path, method, query, dto, **kwargs)
+
+        if path.startswith('markets/') and method == 'POST':
+            self.markets[res[0]['uuid']]['state'] = res[0]['state'] = 'READY_TO_START'
+            self.created[res[0]['uuid']] = time.monotonic()
+
+        return res
+
+
+class RecordingSchedule(AdaptivePollSchedule):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.elapsed = []
+
+    def next_wait(self, plan, elapsed):
+        self.elapsed.append(elapsed)
+
+        return 0.01
+
+
+def test_elapsed_excludes_queued_time():
+    conn = QueuedConnection(polls=3)
+    plan = vp.Plan(conn, vp.PlanSpec('test', scope=['x']))
+    plan.poll_schedule = RecordingSchedule()
+
+    assert plan.run() == vp.MarketState.SUCCEEDED
+    assert plan.poll_schedule.elapsed
+    assert plan.poll_schedule.elapsed[0] == 0
+    assert all(x < 0.2 for x in plan.poll_schedule.elapsed)
+
+
+def test_keys_follow_spec_changes(vmt, tmp_path):
+    spec = vp.PlanSpec('test', scope=['x'])
+    plan = vp.Plan(vmt, spec)
+    path = tmp_path / 'durations.json'
+    path.write_text('{}')
+    schedule = AdaptivePollSchedule(str(path))
+
+    assert schedule.expected(plan) is None
+
+    spec.change_entity(vp.EntityAction.ADD, ['tpl'], count=2)
+    key = f'{spec.type.value}|{int(math.log2(2))}|{spec.fingerprint()}'
+    path.write_text(json.dumps({key: [100]}))
+    schedule.load()
+
+    assert schedule.expected(plan) == (100, 0)
@@ -0,0 +1,57 @@
+import threading
+import time
+
+import vmtplanner as vp
+from vmtplanner.warm import WarmPool
+
+from conftest import FakeConnection
+
+
+
+class HookConnection(FakeConnection):
+    # calls hooks[(method, path)] before handling a matching request
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.hooks = {}
+
+    def _request(self, path, method='GET', query='', dto=None, **kwargs):
+        hook = self.hooks.get((method, path.split('/')[0]))
+
+        if hook is not None:
+            hook()
+
+        return super()._request(path, method, query, dto, **kwargs)
+
+
+def test_expired_scenarios_are_removed_outside_the_lock():
+    conn = HookConnection()
+    pool = WarmPool(conn, size=1, ttl=0.01)
+    pool.add('k', vp.PlanSpec('test', scope=['x']))
+    pool.fill()
+    time.sleep(0.05)
+    blocked = []
+
+    def check():
+        # another caller must not wait on the removal
+        t = threading.Thread(target=pool.ready, args=('k',), daemon=True)
+        t.start()
+        t.join(1)
+        blocked.append(t.is_alive())
+
+    conn.hooks[('DELETE', 'scenarios')] = check
+    plan = pool.acquire('k')
+
+    assert blocked == [False]
+    assert plan.scenario_id is None
+    assert conn.scenarios == {}
+
+
+def test_fill_removes_scenario_of_removed_template():
+    conn = HookConnection()
+    pool = WarmPool(conn, size=1)
+    pool.add('k', vp.PlanSpec('test', scope=['x']))
+    conn.hooks[('POST', 'scenarios')] = lambda: conn.hooks.clear() or pool.remove('k')
+
+    pool.fill()
+
+    assert conn.scenarios == {}
@@ -15,14 +15,20 @@
 
 from collections import defaultdict, namedtuple
 from collections.abc import Mapping
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import copy
 import datetime
 from enum import Enum
 from functools import wraps
+import hashlib
 import json
 import math
+import threading
 import time
 import traceback
+from types import MappingProxyType
+from uuid import uuid4
 import warnings
 
 import umsg
@@ -31,6 +37,11 @@ import vmtconnect as vc
 
 from .__about__ import (__author__, __copyright__, __description__,
                         __license__, __title__, __version__)
+from .cache import entity_cache
+from .context import PlanContext
+from .encoding import get_backend
+from .metrics import PlanMetrics, instrument
+from .retry import RetryPolicy
 
 
 
@@ -49,13 +60,16 @@ __all__ = [
     'EntityAction',
     'InvalidMarketError',
     'MarketError',
+    'MarketSnapshot',
     'MarketState',
+    'PlanContext',
     'PlanError',
     'PlanExecutionExceeded',
     'PlanRunning',
     'PlanRunFailure',
     'PlanDeprovisionError',
     'PlanType',
+    'RetryPolicy',
     'Plan',
     'PlanSpec',
     'ServerResponse'
@@ -65,6 +79,9 @@ umsg.init()
 _VERSION_REQ = ['5.9.0+']
 _VERSION_EXC = []
 
+# system level markets to block certain actions
+_SYSTEM_MARKETS = ['Market', 'Market_Default']
+
 
 
 ## ----------------------------------------------------
@@ -379,6 +396,12 @@ _dto_map_scenario_settings_720 = {
     AutomationSetting.RESIZE: {'configChanges': {'automationSettingList': [{'uuid': 'resize', 'value': '@value:disabled=DISABLED;recommend=RECOMMEND;external=EXTERNAL_APPROVAL;manual=MANUAL;automatic=AUTOMATIC;true=AUTOMATIC;false=DISABLED', 'entityType': 'VirtualMachine'}]}},
 }
 
+# merged settings maps by version, see settings_map()
+_settings_maps = {}
+
+# compiled settings serializers by definition, see compiled_settings()
+_compiled_settings = {}
+
 
 
 ## ----------------------------------------------------
@@ -416,6 +439,65 @@ def deprecated(*fargs):
 PlanHook = namedtuple('PlanHook', ['name', 'args'])
 
 
+class MarketSnapshot:
+    """Point in time view of a market.
+
+    A snapshot wraps a single market response from the server, allowing all
+    state checks made during a polling pass to share one request.
+
+    Args:
+        market (dict): Market DTO as returned by the API.
+        timestamp (float, optional): :func:`time.monotonic` time the market was
+            fetched. (default: now)
+
+    Attributes:
+        age (float): Seconds elapsed since the market was fetched.
+        market (dict): Market DTO.
+        name (str): Market display name.
+        state (:py:class:`MarketState`): Market state, or ``None`` if unknown.
+        timestamp (float): :func:`time.monotonic` time the market was fetched.
+        uuid (str): Market UUID.
+    """
+    __slots__ = ['market', 'timestamp']
+
+    def __init__(self, market, timestamp=None):
+        self.market = market
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+
+    def __repr__(self):
+        return f'MarketSnapshot(uuid={self.uuid!r}, state={self.state}, age={self.age:.1f})'
+
+    @property
+    def age(self):
+        return time.monotonic() - self.timestamp
+
+    @property
+    def name(self):
+        return self.market.get('displayName')
+
+    @property
+    def state(self):
+        try:
+            return MarketState[self.market['state']]
+        except KeyError:
+            return None
+
+    @property
+    def uuid(self):
+        return self.market.get('uuid')
+
+    def is_fresh(self, ttl):
+        """Checks if the snapshot is younger than the given lifetime.
+
+        Args:
+            ttl (float): Lifetime in seconds, 0 = always stale.
+
+        Returns:
+            bool: ``True`` if the snapshot may be reused, ``False`` otherwise.
+        """
+        return ttl > 0 and self.age < ttl
+
+
 class Plan(umsg.mixins.LoggingMixin):
     """Plan instance.
 
@@ -424,36 +506,76 @@ class Plan(umsg.mixins.LoggingMixin):
         spec (:py:class:`PlanSpec`, optional): Settings to apply to the market, if
             running a plan.
         market (str, optional): Base market UUID to apply the settings to.
-        name (str, optional): Plan display name.
+        name (str, optional): Plan display name. If ``None``, a name is generated
+            when first required.
+        context (:py:class:`~vmtplanner.context.PlanContext`, optional):
+            Connection context to use. If ``None``, the shared context of the
+            connection is used.
 
     Attributes:
+        cached (bool): ``True`` if the most recent run returned a cached result,
+            read-only attribute.
+        context (:py:class:`~vmtplanner.context.PlanContext`): Connection context.
         duration (int): Plan duration in seconds, or ``None`` if unavailable.
+        entity_cache (:py:class:`~vmtplanner.cache.EntityCache`): Entity
+            metadata cache used to complete the scope on affected versions.
+            Shared by all plans by default.
+        incremental (bool): If ``True``, each run after the first updates the
+            previous run's scenario with the current spec, only if changed, in
+            place of creating a new scenario. Scenarios shared through the
+            :py:attr:`scenario_cache` are never updated. (default: ``False``)
         initialized (bool): ``True`` if the market is initialized and usable.
+        journal (:py:class:`~vmtplanner.journal.PlanJournal`): Run journal to
+            record runs to, or ``None``.
         market_id (str): Market UUID, read-only attribute.
         market_name (str): Market name, read-only attribute.
+        metrics (:py:class:`~vmtplanner.metrics.PlanMetrics`): Phase timing
+            record of the most recent run, or ``None`` if no plan has been run.
+        poller (:py:class:`~vmtplanner.pool.PlanPoller`): Shared status poller
+            to wait on instead of polling the market individually, or ``None``.
+        poll_schedule (:py:class:`~vmtplanner.schedule.AdaptivePollSchedule`):
+            Polling schedule used in place of :py:attr:`PlanSpec.poll_freq`, or
+            ``None``.
+        scenario_cache (:py:class:`~vmtplanner.cache.ScenarioCache`): Cache of
+            reusable scenarios, or ``None`` to always create a new scenario.
         result (:py:class:`~vmtplanner.MarketState`): Market run result state.
+        result_cache (:py:class:`~vmtplanner.cache.ResultCache`): Cache of plan
+            run results, or ``None`` to always run the market.
+        run_id (str): Unique identifier of the current or most recent run,
+            read-only attribute.
+        retry_policy (:py:class:`~vmtplanner.retry.RetryPolicy`): Retry policy,
+            or ``None`` to use a default policy with :py:attr:`PlanSpec.max_retry`
+            attempts.
         scenario_id (str): Scenario UUID, read-only attribute.
         scenario_name (str): Scenario name, read-only attribute.
         script_duration (int): Plan script duration in seconds.
         server_duration (int): Plan server side duration in seconds.
+        snapshot (:py:class:`MarketSnapshot`): Most recently fetched market
+            data, or ``None`` if the market has not been queried.
+        spec (:py:class:`PlanSpec`): Plan scenario specification, read-only
+            attribute.
         state (:py:class:`MarketState`): Current state of the market.
         start (:py:class:`~datetime.datetime`): :py:class:`~datetime.datetime` object
             representing the start time, or ``None`` if no plan has been run.
         unplaced_entities (bool): ``True`` if there are unplaced entities.
     """
-    # system level markets to block certain actions
-    __system = ['Market', 'Market_Default']
+    __system = _SYSTEM_MARKETS
 
     __datetime_format = "%Y-%m-%dT%H:%M:%S%z"
 
-    def __init__(self, connection, spec=None, market='Market', name=None):
+    def __init__(self, connection, spec=None, market='Market', name=None, context=None):
         super().__init__()
         self._vmt = connection
+        self.context = context or PlanContext.get(connection)
         self.__init = False
         self.__scenario_id = None
         self.__scenario_name = spec.name if spec is not None else None
+        self.__scenario_reused = False
+        self.__prepared = False
+        self._scenario_json = None
+        self._scenario_stale = False
         self.__market_id = None
-        self.__market_name = name if name else self.__gen_market_name()
+        self.__market_name = name or None
         self.__plan = spec
         self.__plan_start = None
         self.__plan_end = None
@@ -461,15 +583,31 @@ class Plan(umsg.mixins.LoggingMixin):
         self.__plan_server_start = None
         self.__plan_server_end = None
         self.__plan_server_duration = None
+        self.__snapshot = None
+        self.__cached = None
+        self.__running_since = None
+        self.__metrics = None
         self.__hook_preprocessor = None
         self.__hook_postprocessor = None
+        self.__hook_metrics = None
+        self._running = threading.Lock()
+        self._run_id = None
+        self.__tracking = False
         self.result = None
         self.unplaced = None
         self.base_market = market
+        self.poller = None
+        self.poll_schedule = None
+        self.scenario_cache = None
+        self.incremental = False
+        self.result_cache = None
+        self.entity_cache = entity_cache
+        self.retry_policy = None
+        self.journal = None
 
         # enforce module specific version exclusions
-        vspec = vc.VersionSpec(_VERSION_REQ, exclude=_VERSION_EXC)
-        vspec.check(self._vmt.version)
+        self.context.check_version(_VERSION_REQ, _VERSION_EXC)
+        instrument(self._vmt)
 
         # assign the spec version to build
         if self.__plan.version is None:
@@ -481,6 +619,10 @@ class Plan(umsg.mixins.LoggingMixin):
 
         self.log('Plan initialized', level='debug')
 
+    @property
+    def cached(self):
+        return self.__cached is not None
+
     @property
     def initialized(self):
         return self.__init
@@ -525,8 +667,27 @@ class Plan(umsg.mixins.LoggingMixin):
 
     @property
     def market_name(self):
+        if self.__market_name is None:
+            self.__market_name = self.__gen_market_name()
+
         return self.__market_name
 
+    @property
+    def metrics(self):
+        return self.__metrics
+
+    @property
+    def run_id(self):
+        return self._run_id
+
+    @property
+    def snapshot(self):
+        return self.__snapshot
+
+    @property
+    def spec(self):
+        return self.__plan
+
     @property
     def unplaced_entities(self):
         return self.unplaced
@@ -537,11 +698,27 @@ class Plan(umsg.mixins.LoggingMixin):
         return self.result
 
     def __gen_market_name(self):
-        user = self._vmt.get_users('me')[0]['username']
-        return f'CUSTOM_{user}_{str(int(time.time()))}'
+        # the random suffix keeps names unique across concurrent plans
+        return f'CUSTOM_{self.context.user}_{str(int(time.time()))}_{uuid4().hex[:8]}'
+
+    def __get_snapshot(self):
+        # reuse the last market fetch if it is of the current market, and within
+        # the state TTL; a cached result has no market of its own to fetch
+        if self.__cached is not None:
+            return self.__snapshot
+
+        if self.__snapshot is not None and self.__snapshot.uuid == self.__market_id \
+           and self.__snapshot.is_fresh(self.__plan.state_ttl):
+            return self.__snapshot
+
+        return self.refresh()
 
     def __sync_server_data(self):
-        market = self._vmt.get_markets(uuid=self.__market_id)[0]
+        # the final polling pass has already fetched the completed market
+        if self.__snapshot is None:
+            self.refresh()
+
+        market = self.__snapshot.market
 
         try:
             self.__market_id = market['uuid']
@@ -560,7 +737,7 @@ class Plan(umsg.mixins.LoggingMixin):
         start = datetime.datetime.now()
 
         while True:
-            if self.is_complete() or self.is_stopped():
+            if self.refresh().state in (MarketState.SUCCEEDED, MarketState.STOPPED):
                 return True
 
             run_time = (datetime.datetime.now() - start).total_seconds() / 60
@@ -572,44 +749,54 @@ class Plan(umsg.mixins.LoggingMixin):
 
         raise PlanError
 
-    def __wait_for_plan(self):
-        def rnd_up(number, multiple):
-            num = math.ceil(number) + (multiple - 1)
-            return num - (num % multiple)
+    def __abort(self):
+        try:
+            self.stop()
+        except vc.HTTP502Error:
+            pass
+        except vc.HTTP500Error:
+            raise PlanError('Server error stopping plan')
+        except vc.HTTPError:
+            raise PlanError('Plan stop command error')
+
+        raise PlanExecutionExceeded(f'Plan execution time exceeded maximum allowed, market state: {self.get_state()}')
+
+    def __wait_for_poller(self):
+        future = self.poller.watch(self)
+
+        try:
+            future.result(timeout=self._remaining())
+        except FutureTimeoutError:
+            self.poller.unwatch(self)
+            self.__abort()
+
+    def __wait_for_plan(self, policy):
+        if self.poller is not None:
+            return self.__wait_for_poller()
+
+        # one market fetch per pass, shared by all state checks
+        passes = 0
 
         while True:
-            if self.is_complete() or self.is_stopped():
+            if self._check_progress(policy.call(self.refresh, stage='poll').state, passes):
                 break
-            elif self.__plan.timeout > 0 \
-                 and datetime.datetime.now() >= (self.__plan_start + \
-                     datetime.timedelta(minutes=self.__plan.timeout)):
-                try:
-                    self.stop()
-                except vc.HTTP502Error:
-                    pass
-                except vc.HTTP500Error:
-                    raise PlanError('Server error stopping plan')
-                except vc.HTTPError:
-                    raise PlanError('Plan stop command error')
-
-                raise PlanExecutionExceeded(f'Plan execution time exceeded maximum allowed, market state: {self.get_state()}')
+            elif self._is_expired():
+                self.__abort()
             else:
-                if self.__plan.poll_freq > 0:
-                    wait = self.__plan.poll_freq
-                else:
-                    run_time = (datetime.datetime.now() - self.__plan_start).total_seconds()
-                    wait = rnd_up(run_time/12, 5) if run_time < 600 else 60
-
-                time.sleep(wait)
-
-                if self.is_state(MarketState.CREATED):
-                    # catches a failed start after the first wait,
-                    # indicates a stuck plan
-                    raise PlanRunFailure(f'Plan failed to properly initialize. Check catalina.out for more details. Market ID: [{self.__market_id}], Scenario ID: [{self.__scenario_id}]')
+                time.sleep(self._poll_wait())
+                passes += 1
 
     def __delete(self, scenario=True):
         m = self._vmt.del_market(self.__market_id)
-        s = True if scenario else self._vmt.del_scenario(self.__scenario_id)
+        s = True
+
+        # cached scenarios are removed by the cache once no longer referenced
+        if self.scenario_cache is not None \
+           and self.scenario_cache.release(self, self.__scenario_id, remove=scenario):
+            pass
+        elif scenario:
+            s = self._vmt.del_scenario(self.__scenario_id)
+            self._scenario_json = None
 
         if m and s:
             return True
@@ -625,58 +812,443 @@ class Plan(umsg.mixins.LoggingMixin):
         # 5.9.1 and later compatibility
         return self._vmt.request('scenarios', method='POST', dto=dto)[0]
 
-    def __init_scenario(self):
+    def _check_progress(self, state, passes):
+        # returns True once the market reaches a final state
+        if state in (MarketState.SUCCEEDED, MarketState.STOPPED):
+            return True
+
+        if passes and state == MarketState.CREATED:
+            # catches a failed start after the first wait,
+            # indicates a stuck plan
+            raise PlanRunFailure(f'Plan failed to properly initialize. Check catalina.out for more details. Market ID: [{self.__market_id}], Scenario ID: [{self.__scenario_id}]')
+
+        return False
+
+    def _is_expired(self):
+        return self.__plan.timeout > 0 \
+               and datetime.datetime.now() >= (self.__plan_start + \
+                   datetime.timedelta(minutes=self.__plan.timeout))
+
+    def _remaining(self):
+        # seconds left before the plan timeout, None if unlimited
+        if self.__plan.timeout <= 0:
+            return None
+
+        end = self.__plan_start + datetime.timedelta(minutes=self.__plan.timeout)
+
+        return max((end - datetime.datetime.now()).total_seconds(), 0)
+
+    def __enter_phase(self, name):
+        if self.__metrics is not None:
+            self.__metrics.enter(name)
+
+    def _retry_policy(self):
+        if self.retry_policy is not None:
+            return self.retry_policy
+
+        return RetryPolicy(max_retry=self.__plan.max_retry)
+
+    def _reset_stages(self):
+        # a new run creates a new scenario and market, unless a scenario was
+        # assigned to it, or the previous scenario is to be updated
+        keep = self.__prepared or (self.incremental and self._scenario_json is not None)
+
+        if not keep:
+            if self.__scenario_id is not None and self.scenario_cache is not None:
+                self.scenario_cache.release(self, self.__scenario_id)
+
+            self.__scenario_id = None
+            self._scenario_json = None
+
+        self._scenario_stale = keep and self.__scenario_id is not None
+        self.__prepared = False
+        self.__market_id = None
+        self.__snapshot = None
+        self.__running_since = None
+
+    def _abandon_market(self, policy):
+        # removes the market of a failed attempt, the scenario is kept for reuse
+        market, self.__market_id = self.__market_id, None
+        self.__init = False
+        self.__running_since = None
+        self.__journal_record()
+
+        if market is None or not policy.cleanup:
+            return
+
+        try:
+            if self.__snapshot is not None and self.__snapshot.uuid == market \
+               and self.__snapshot.state == MarketState.RUNNING:
+                self._vmt.request('markets', uuid=market, method='PUT',
+                                  query='operation=stop')
+
+            self._vmt.del_market(market)
+        except Exception as e:                                                 # pylint: disable=W0703
+            self.log(f'Unable to remove abandoned market [{market}]: {e}', level='warn')
+
+    def __journal_record(self, status='running', error=None):
+        if self.journal is None:
+            return
+
+        try:
+            self.journal.record(self, status, error)
+        except Exception as e:                                                 # pylint: disable=W0703
+            self.log(f'Unable to record plan run [{self._run_id}] to journal: {e}', level='warn')
+
+    def _set_snapshot(self, snapshot):
+        self.__snapshot = snapshot
+
+        if self.__tracking:
+            self.__journal_record()
+
+        if snapshot.state in (MarketState.COPYING, MarketState.CREATED,
+                              MarketState.READY_TO_START):
+            return
+
+        # server run time is measured from when the market was first seen running
+        if self.__running_since is None:
+            self.__running_since = snapshot.timestamp
+
+        if self.__metrics is not None:
+            self.__metrics.mark_running()
+
+    def _poll_wait(self):
+        def rnd_up(number, multiple):
+            num = math.ceil(number) + (multiple - 1)
+            return num - (num % multiple)
+
+        run_time = (datetime.datetime.now() - self.__plan_start).total_seconds()
+
+        if self.poll_schedule is not None:
+            running = self.__running_since
+            elapsed = time.monotonic() - running if running is not None else 0
+            wait = self.poll_schedule.next_wait(self, elapsed)
+
+            if wait is not None:
+                return wait
+
+        if self.__plan.poll_freq > 0:
+            return self.__plan.poll_freq
+
+        return rnd_up(run_time/12, 5) if run_time < 600 else 60
+
+    def _scenario_dto(self):
         if vc.VersionSpec.cmp_ver(self.__plan.version.base_version, '7.21.0') >= 0 and \
            vc.VersionSpec.cmp_ver(self.__plan.version.base_version, '7.21.5') < 0:
             # special case for OM-57067
             # we must augement scope input to work around the bug
-            dto = json.loads(self.__plan.json)
+            dto = json.loads(self.__plan.to_bytes())
+            meta = self.entity_cache.lookup(self._vmt, [x['uuid'] for x in dto['scope']])
 
-            for i, _ in enumerate(dto['scope']):
-                ent = self._vmt.search(uuid=dto['scope'][i]['uuid'])[0]
-                dto['scope'][i]['displayName'] = ent['displayName']
-                dto['scope'][i]['className'] = ent['className']
+            for x in dto['scope']:
+                x.update(meta[x['uuid']])
 
-            response = self.__init_scenario_request(json.dumps(dto))
-        else:
-            # create the scenario for the plan
-            response = self.__init_scenario_request(self.__plan.json)
+            return get_backend().encode(dto)
 
+        return self.__plan.to_bytes()
+
+    def _update_scenario(self, dto=None):
+        # replaces the existing scenario definition with the current spec, the
+        # API has no partial scenario update
+        dto = dto or self._scenario_dto()
+        response = self._vmt.request('scenarios', uuid=self.__scenario_id,
+                                     method='PUT', dto=dto)[0]
+        self.__scenario_name = response.get('displayName', self.__scenario_name)
+        self._scenario_json = dto
+
+        return self.__scenario_id
+
+    def _sync_scenario(self):
+        # brings a kept scenario up to date, the update is skipped if the spec
+        # produces the same DTO the scenario was last given
+        self.__enter_phase('scenario')
+        dto = self._scenario_dto()
+
+        try:
+            if dto != self._scenario_json:
+                self._update_scenario(dto)
+        except vc.HTTP404Error:
+            # the scenario was removed from the server
+            self.__scenario_id = None
+            self._init_scenario()
+
+        self._scenario_stale = False
+
+        return self.__scenario_id
+
+    def _use_scenario(self, uuid, name, dto=None):
+        # assigns an existing scenario to the next run, dto is the scenario's
+        # current definition, if known
+        self.__scenario_id = uuid
+        self.__scenario_name = name
+        self._scenario_json = dto
+        self.__prepared = True
+
+    def _init_scenario(self):
+        self.__enter_phase('scenario')
+        key = None
+        self.__scenario_reused = False
+
+        if self.scenario_cache is not None:
+            key = self.scenario_cache.key(self)
+            scenario = self.scenario_cache.acquire(self, key)
+
+            if scenario is not None:
+                self.__scenario_id, self.__scenario_name = scenario
+                self.__scenario_reused = True
+                self._scenario_json = None
+
+                return self.__scenario_id
+
+        # create the scenario for the plan
+        dto = self._scenario_dto()
+        response = self.__init_scenario_request(dto)
         self.__scenario_id = response['uuid']
         self.__scenario_name = response['displayName']
+        self._scenario_json = dto
+
+        # cached scenarios are shared, and must not be updated
+        if self.scenario_cache is not None \
+           and self.scenario_cache.add(self, self.__scenario_id, self.__scenario_name, key):
+            self._scenario_json = None
 
         return response['uuid']
 
-    def __init_market(self):
+    def _init_market(self):
+        self.__enter_phase('market')
+        self.__journal_record()
+
         # create the plan market, and apply the scenario
         path = 'markets/{}/scenarios/{}'.format(self.base_market, self.__scenario_id)
-        param = {'plan_market_name': self.__market_name}
+        param = {'plan_market_name': self.market_name}
 
         if self.__plan.params:
             param.update(self.__plan.params)
 
-        response = self._vmt.request(path, method='POST', query=param)[0]
+        try:
+            response = self._vmt.request(path, method='POST', query=param)[0]
+        except vc.HTTP404Error:
+            if not self.__scenario_reused:
+                raise
+
+            # the cached scenario was removed from the server
+            self.scenario_cache.discard(self.__scenario_id)
+            self._init_scenario()
+
+            return self._init_market()
 
         self.__market_id = response['uuid']
         self.__market_name = response['displayName']
 
         return response['uuid']
 
-    def __run(self, async=False):
-        # main plan execution control
-        self.__init_scenario()
-        self.__init_market()
+    def _mark_started(self):
         self.__init = True
         self.__plan_start = datetime.datetime.now()
+        self.__enter_phase('queued')
+        self.__journal_record()
 
-        if async:
-            return self.state
+    def _record_duration(self):
+        self.__plan_duration = (datetime.datetime.now() - self.__plan_start).total_seconds()
 
-        self.__wait_for_plan()
+    def _finish(self):
+        # collects the completed market details, returns the final state
+        self.__enter_phase('sync')
         self.__sync_server_data()
-        self.__plan_duration = (datetime.datetime.now() - self.__plan_start).total_seconds()
+        self._record_duration()
+
+        if self.poll_schedule is not None:
+            self.poll_schedule.record(self)
+
+        if self.__metrics is not None:
+            self.__metrics.leave()
+
+        return self.__snapshot.state
+
+    def _attach(self, market):
+        # rebuilds the run state from an existing market
+        scenario = market.get('scenario', {})
+        self.__market_id = market['uuid']
+        self.__market_name = market.get('displayName')
+        self.__scenario_id = scenario.get('uuid')
+        self.__scenario_name = scenario.get('displayName', self.__scenario_name)
+        self.__init = True
+
+        try:
+            start = datetime.datetime.strptime(market['runDate'], self.__datetime_format)
+            self.__plan_start = start.astimezone().replace(tzinfo=None)
+        except (KeyError, TypeError, ValueError):
+            self.__plan_start = datetime.datetime.now()
+
+        self._set_snapshot(MarketSnapshot(market))
+
+    def _request_stop(self):
+        self._vmt.request('markets', uuid=self.__market_id, method='PUT',
+                           query='operation=stop')
+
+    def _hook(self, name):
+        # the pre_hook or post_hook processor, or None
+        return self.__hook_preprocessor if name == 'pre_hook' else self.__hook_postprocessor
+
+    def _pre_hook(self):
+        if self.__hook_preprocessor:
+            with self.__metrics.phase('pre_hook'):
+                return self.__hook_preprocessor.name(*self.__hook_preprocessor.args)
+
+    def _post_hook(self):
+        if self.__hook_postprocessor:
+            with self.__metrics.phase('post_hook'):
+                return self.__hook_postprocessor.name(*self.__hook_postprocessor.args)
+
+        return self.result
+
+    def _result_key(self):
+        # post processing parameters set apart from the spec, which must match
+        # for a cached result to be reused
+        return ()
+
+    def _restore_result(self, result):
+        # restores post processing state from a cached hook result
+        pass
+
+    def _cache_lookup(self):
+        # applies a fresh cached result, if any, in place of a run
+        self.__cached = None
+
+        if self.result_cache is None:
+            return None
+
+        entry = self.result_cache.get(self)
+
+        if entry is None:
+            return None
+
+        # the plan no longer owns the market of any previous run
+        self.log('Using cached plan result', level='debug')
+        self._reset_stages()
+        self.__init = False
+        self.__cached = entry
+        self.__snapshot = entry.snapshot
+        self.result = entry.state
+        self.unplaced = entry.snapshot.market.get('unplacedEntities')
+        self._restore_result(entry.result)
+
+        return entry
+
+    def _cache_result(self, result):
+        if self.result_cache is not None and self.result == MarketState.SUCCEEDED:
+            self.result_cache.add(self, result)
+
+    def _begin_metrics(self):
+        self.__metrics = PlanMetrics()
+
+        return self.__metrics
+
+    @contextmanager
+    def _tracked(self, lock=True, complete=True, run_id=None):
+        # run bookkeeping shared by the run methods: the running lock, metrics,
+        # and the journal entry
+        if lock and not self._running.acquire(blocking=False):
+            raise PlanRunning(f'Plan [{self.market_name}] is already running')
+
+        self._run_id = run_id or uuid4().hex
+        self.__tracking = True
+        metrics = self._begin_metrics()
+        error = None
+
+        try:
+            self.__journal_record()
+
+            with metrics.activate():
+                yield metrics
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.__tracking = False
+            self._end_metrics()
+
+            if error is not None:
+                self.__journal_record('failed', error)
+            elif complete:
+                self.__journal_record('complete')
+
+            if lock:
+                self._running.release()
+
+    def _end_metrics(self):
+        # closes the run record, and reports it to the metrics hook
+        self.__metrics.server_duration = self.__plan_server_duration
+        self.__metrics.close()
+
+        if self.__hook_metrics:
+            try:
+                self.__hook_metrics.name(self.__metrics, *self.__hook_metrics.args)
+            except Exception as e:                                             # pylint: disable=W0703
+                self.log(f'Metrics hook error: {e}', level='warn')
+
+    def __run(self, wait=True, policy=None):
+        # main plan execution control, a scenario created by a previous
+        # attempt is reused
+        policy = policy or self._retry_policy()
+
+        if self.__scenario_id is None:
+            policy.call(self._init_scenario, stage='scenario')
+        elif self._scenario_stale:
+            policy.call(self._sync_scenario, stage='scenario')
+
+        policy.call(self._init_market, stage='market')
+        self._mark_started()
+
+        if not wait:
+            return self.state
+
+        self.__wait_for_plan(policy)
+
+        return self._finish()
+
+    @classmethod
+    def from_market(cls, connection, market_id, spec=None, **kwargs):
+        """Creates a plan attached to an existing plan market.
+
+        The plan state is rebuilt from the server, allowing a plan started by
+        another process to be completed with :meth:`resume`, without creating a
+        new scenario or market.
+
+        Args:
+            connection (:py:class:`~vmtconnect.Connection`): :py:class:`~vmtconnect.Connection` or :py:class:`~vmtconnect.Session`.
+            market_id (str): Plan market UUID.
+            spec (:py:class:`PlanSpec`, optional): Specification the market was
+                created from. If ``None``, a specification with the market
+                scenario name, type, and scope is used.
+            **kwargs: Additional plan class arguments.
+
+        Returns:
+            :py:class:`Plan`: Plan instance of the calling class.
 
-        return self.state
+        Raises:
+            InvalidMarketError: Attempting to attach to a system market.
+        """
+        market = None if market_id in _SYSTEM_MARKETS else connection.get_markets(uuid=market_id)[0]
+
+        if market is None or market.get('displayName') in _SYSTEM_MARKETS:
+            raise InvalidMarketError('Attempting to attach to system market')
+
+        if spec is None:
+            scenario = market.get('scenario', {})
+
+            try:
+                type = PlanType(scenario.get('type'))
+            except ValueError:
+                type = PlanType.CUSTOM
+
+            spec = PlanSpec(scenario.get('displayName'), type,
+                            [x['uuid'] for x in scenario.get('scope', [])])
+
+        plan = cls(connection, spec, **kwargs)
+        plan._attach(market)
+
+        return plan
 
     def get_stats(self):
         """Returns statistics for the market.
@@ -684,6 +1256,12 @@ class Plan(umsg.mixins.LoggingMixin):
         Returns:
             list: A list of statistics by period.
         """
+        if self.__cached is not None:
+            if self.__cached.stats is not None:
+                return copy.deepcopy(self.__cached.stats)
+
+            return self._vmt.get_market_stats(self.__cached.snapshot.uuid)
+
         return self._vmt.get_market_stats(self.__market_id)
 
     def is_system(self):
@@ -692,7 +1270,7 @@ class Plan(umsg.mixins.LoggingMixin):
         Returns:
             bool: ``True`` if the market is a designated system market, ``False`` otherwise.
         """
-        if self.__market_name in self.__system:
+        if self.market_name in self.__system:
             return True
 
         return False
@@ -730,14 +1308,23 @@ class Plan(umsg.mixins.LoggingMixin):
         Returns:
             :py:class:`MarketState`: Current market state.
         """
-        try:
-            market = self._vmt.get_markets(uuid=self.__market_id)
-            self.__init = True
+        state = self.__get_snapshot().state
+        self.__init = self.__cached is None
 
-            return MarketState[market[0]['state']]
+        return state
 
-        except KeyError:
-            return None
+    def refresh(self):
+        """Fetches the market from the server.
+
+        All state checks reuse the returned snapshot until it is older than
+        the :py:attr:`PlanSpec.state_ttl`.
+
+        Returns:
+            :py:class:`MarketSnapshot`: Current market data.
+        """
+        self._set_snapshot(MarketSnapshot(self._vmt.get_markets(uuid=self.__market_id)[0]))
+
+        return self.__snapshot
 
     def hook_pre(self, name, *args, **kwargs):
         self.__hook_preprocessor = PlanHook(name, args)
@@ -745,46 +1332,169 @@ class Plan(umsg.mixins.LoggingMixin):
     def hook_post(self, name, *args, **kwargs):
         self.__hook_postprocessor = PlanHook(name, args)
 
+    def hook_metrics(self, name, *args, **kwargs):
+        """Sets a callback to receive the timing record of each run.
+
+        The callback is called with the :py:class:`~vmtplanner.metrics.PlanMetrics`
+        record, followed by any additional arguments, once the run completes,
+        whether successfully or not.
+
+        Args:
+            name (callable): Callback function.
+            *args: Additional callback arguments.
+        """
+        self.__hook_metrics = PlanHook(name, args)
+
+    def reuse_scenario(self, plan):
+        """Assigns the scenario of a previous plan to the next run.
+
+        When run, the scenario is updated with this plan's spec, only if it
+        produces a different DTO, in place of creating a new scenario. The
+        scenario is no longer owned by the previous plan, which should be
+        removed with ``delete(scenario=False)``.
+
+        Args:
+            plan (:py:class:`Plan`): Previously run plan.
+
+        Raises:
+            PlanError: If the plan has no scenario which may be updated.
+        """
+        if plan.scenario_id is None or plan._scenario_json is None:
+            raise PlanError('Plan has no reusable scenario')
+
+        self._use_scenario(plan.scenario_id, plan.scenario_name, plan._scenario_json)
+        plan._scenario_json = None
+
     def run(self):
         """Runs the market with currently applied scenario and settings.
 
         Raises:
+            PlanRunning if the plan is already being run.
             PlanError if retry limit is reached.
         """
-        if self.__hook_preprocessor:
-            self.__hook_preprocessor.name(*self.__hook_preprocessor.args)
+        with self._tracked():
+            return self.__run_hooked()
+
+    def resume(self):
+        """Completes a plan attached with :meth:`from_market`.
+
+        Waits for the market to finish if it is still in progress, then collects
+        the market details and calls the post processing hook. The pre
+        processing hook is not called. Status polls are retried per the
+        :py:attr:`retry_policy`, however a failed market is not rerun.
+
+        Returns:
+            The post processing hook result, or the final market state.
+
+        Raises:
+            PlanRunning if the plan is already being run.
+        """
+        with self._tracked(run_id=self._run_id):
+            return self.__resume()
+
+    def __resume(self):
+        self.__metrics.begin_attempt()
 
+        try:
+            self.__enter_phase('queued')
+
+            if not self._check_progress(self.__get_snapshot().state, 0):
+                self.__wait_for_plan(self._retry_policy())
+
+            self.result = self._finish()
+        except Exception as e:
+            self.__metrics.end_attempt(e)
+            raise
+
+        self.__metrics.end_attempt()
+
+        return self._post_hook()
+
+    def __run_hooked(self):
+        # the previous run's result must not stand in for a failed rerun
+        self.result = None
+        self._pre_hook()
+
+        cached = self._cache_lookup()
+
+        if cached is not None:
+            return cached.result
+
+        policy = self._retry_policy()
         run = 0
         ret = None
         trace = None
+        self._reset_stages()
+
+        while run < policy.max_retry:
+            self.__metrics.begin_attempt()
 
-        while run < self.__plan.max_retry:
             try:
-                self.result = self.__run()
+                self.result = self.__run(policy=policy)
+                self.__metrics.end_attempt()
                 break
-            except (vc.HTTP500Error, PlanError):
+            except (PlanError, *policy.transient) as e:
+                self.__metrics.end_attempt(e)
                 trace = traceback.format_exc()
                 run += 1
-                pass
+                self._abandon_market(policy)
+
+                if run < policy.max_retry:
+                    time.sleep(policy.delay(run))
 
         if not self.result:
             raise PlanError(f'Retry limit reached. Last error:\n{trace}')
 
-        if self.__hook_postprocessor:
-            return self.__hook_postprocessor.name(*self.__hook_postprocessor.args)
+        ret = self._post_hook()
+        self._cache_result(ret)
 
-        return self.result
+        return ret
 
     def run_async(self):
-        # TODO: make async threaded so it is called with hooks and settings
-        """Runs the market plan in asynchronous mode.
+        """Starts the market plan without waiting for it to finish.
+
+        The plan will be started and the state returned immediately. All
+        settings pertaining to polling, timeout, and retry will be ignored. The
+        :py:class:`~Plan.duration` will not be recorded, and plan hooks are not
+        called. Use :meth:`submit` to run the complete plan in the background.
+        """
+        # the run remains unfinished in the journal, see resume()
+        with self._tracked(lock=False, complete=False):
+            self._reset_stages()
+            return self.__run(wait=False)
+
+    def submit(self, executor=None):
+        """Runs the plan in the background.
+
+        The full :meth:`run` semantics apply, including the pre and post
+        processing hooks, retries, timeout, and duration tracking.
 
-        When run asynchronously the plan will be started and the state returned
-        immediately. All settings pertaining to polling, timeout, and retry
-        will be ignored. The :py:class:`~Plan.duration` will not be recorded, and
-        plan hooks are not called.
+        Args:
+            executor (:py:class:`~concurrent.futures.Executor`, optional): Executor
+                to run the plan with. If ``None``, a dedicated thread is used.
+
+        Returns:
+            :py:class:`~concurrent.futures.Future`: Resolves to the :meth:`run`
+            return value, or raises the exception :meth:`run` raised, including
+            :py:class:`PlanRunning` if the plan is already running.
+
+        Note:
+            The plan makes its requests on its own copy of the connection from
+            then on, see :meth:`~vmtplanner.context.PlanContext.copy_connection`,
+            as the connection may not be shared with the calling thread.
         """
-        return self.__run(async=True)
+        self._vmt = PlanContext.copy_connection(self._vmt)
+
+        if executor is not None:
+            return executor.submit(self.run)
+
+        executor = ThreadPoolExecutor(max_workers=1)
+
+        try:
+            return executor.submit(self.run)
+        finally:
+            # the worker thread exits once the plan finishes
+            executor.shutdown(wait=False)
 
     def stop(self):
         """Stops the market.
@@ -797,10 +1507,9 @@ class Plan(umsg.mixins.LoggingMixin):
             PlanError: Error stopping plan
         """
         try:
-            self._vmt.request('markets', uuid=self.__market_id, method='PUT',
-                               query='operation=stop')
+            self._request_stop()
             self.__wait_for_stop()
-            self.__plan_duration = (datetime.datetime.now() - self.__plan_start).total_seconds()
+            self._record_duration()
 
         except vc.HTTP500Error:
             raise
@@ -815,6 +1524,10 @@ class Plan(umsg.mixins.LoggingMixin):
         Args:
             scenario (bool, optional): If ``True``, removes the scenario as well. (default: ``True``)
 
+        Note:
+            Scenarios managed by a :py:attr:`scenario_cache` are released to
+            the cache, which removes them once they are no longer shared.
+
         Returns:
             bool: ``True`` upon success, ``False`` otherwise.
 
@@ -829,13 +1542,23 @@ class Plan(umsg.mixins.LoggingMixin):
         if not self.__init:
             raise InvalidMarketError('Market does not exist')
 
-        if self.__delete(scenario) == ServerResponse.TRUE:
+        if self.__delete(scenario):
             self.__init = False
             return True
 
         return False
 
 
+class _DTOEntry:
+    __slots__ = ['key', 'dto', 'encoded', 'fingerprint']
+
+    def __init__(self, key, dto):
+        self.key = key
+        self.dto = dto
+        self.encoded = {}
+        self.fingerprint = None
+
+
 # adapted from pytur
 class PlanSpec:
     """Plan scenario specification.
@@ -851,6 +1574,9 @@ class PlanSpec:
         abort_poll_freq (int): Abort status polling interval in seconds.
         max_retry (int): Plan retry limit.
         poll_freq (int): Status polling interval in seconds, 0 = dynamic.
+        scope (list): List of scope entity or group UUIDs, read-only attribute.
+        state_ttl (int): Seconds a fetched market state may be reused by
+            :py:attr:`Plan.state` and the ``is_*`` checks, 0 = always refresh.
         timeout (int): Plan timeout in minutes, 0 = infinite.
 
     Note:
@@ -864,7 +1590,12 @@ class PlanSpec:
     def __init__(self, name=None, type=PlanType.CUSTOM, scope=None, version=None):
         # private
         self.__settings = []
+        self.__index = None
+        self.__fields = {}
+        self.__shared = set()
         self.__projection = [0]
+        self.__generation = 0
+        self.__dtos = {}
 
         # public
         self.version = version
@@ -876,6 +1607,7 @@ class PlanSpec:
         self.abort_poll_freq = 5
         self.max_retry = 3
         self.poll_freq = 0
+        self.state_ttl = 0
         self.timeout = 0
 
         self.set_scope(scope)
@@ -892,51 +1624,122 @@ class PlanSpec:
     def params(self):
         return self.get_params()
 
+    @property
+    def scope(self):
+        return [x['value'] for x in self.__scope]
+
+    def __setting_index(self, setting, field=None):
+        # entry positions of a setting, or of a setting by field value, the
+        # indexes are built on first use
+        if self.__index is None:
+            self.__index = defaultdict(list)
+            self.__fields = {}
+
+            for i, v in enumerate(self.__settings):
+                if v is not None:
+                    self.__index[list(v)[0]].append(i)
+
+        if field is None:
+            return self.__index[setting]
+
+        key = (setting, field)
+
+        if key not in self.__fields:
+            index = defaultdict(list)
+
+            for i in self.__index[setting]:
+                index[self.__settings[i][setting].get(field)].append(i)
+
+            self.__fields[key] = index
+
+        return self.__fields[key]
+
+    def __setting_match(self, setting, filter=None):
+        if filter is None:
+            return list(self.__setting_index(setting))
+
+        if len(filter) == 1:
+            field, value = next(iter(filter.items()))
+
+            try:
+                return list(self.__setting_index(setting, field).get(value, []))
+            except TypeError:
+                # unhashable field values, or nested filter keys
+                pass
+
+        return [i for i in self.__setting_index(setting)
+                if all(check_key_value(self.__settings[i][setting], k, v) for k, v in filter.items())]
+
+    def __touch(self):
+        # every change to the settings invalidates the cached DTOs
+        self.__generation += 1
+
+    def __dto(self, version):
+        # cached DTO of the current settings for a version
+        version = version if version else self.version
+
+        if not version:
+            raise PlanError('Unable to map settings to version type of None')
+
+        key = (self.__generation, self.name, self.type)
+        entry = self.__dtos.get(version.base_version)
+
+        if entry is None or entry.key != key:
+            entry = _DTOEntry(key, self.__build_dto(version))
+            self.__dtos[version.base_version] = entry
+
+        return version, entry
+
     def __setting_add(self, setting, values):
         self.__settings.append({setting: values})
+        self.__touch()
 
-    def __setting_update(self, setting, values, filter=None):
-        found = False
+        if self.__index is not None:
+            i = len(self.__settings) - 1
+            self.__index[setting].append(i)
+
+            for (s, f), index in self.__fields.items():
+                if s == setting:
+                    index[values.get(f)].append(i)
 
-        for v in self.__settings:
-            key = list(v)[0]
+    def __setting_writable(self, index):
+        # settings shared with derived specs are copied before being modified
+        v = self.__settings[index]
 
-            if key == setting:
-                try:
-                    for fk, fv in filter.items():
-                        if not check_key_value(v[key], fk, fv):
-                            raise ContinueOuter
+        if id(v) in self.__shared:
+            self.__shared.discard(id(v))
+            v = self.__settings[index] = copy.deepcopy(v)
 
-                        found = True
+        return v
 
-                except AttributeError:
-                    found = True
-                    pass
-                except ContinueOuter:
-                    continue
+    def __setting_update(self, setting, values, filter=None):
+        matches = self.__setting_match(setting, filter)
+        self.__touch()
+
+        for i in matches:
+            v = self.__setting_writable(i)[setting]
 
-                for nk, nv in values.items():
-                    set_key_value(v[key], nk, nv)
+            # move the entry if an indexed field changes
+            for (s, f), index in self.__fields.items():
+                if s == setting and f in values and v.get(f) != values[f]:
+                    index[v.get(f)].remove(i)
+                    index[values[f]].append(i)
 
-        if not found:
+            for nk, nv in values.items():
+                set_key_value(v, nk, nv)
+
+        if not matches:
             self.__setting_add(setting, values)
 
     def __setting_remove(self, setting, filter=None):
-        for v in self.__settings:
-            key = list(v)[0]
-
-            if key == setting:
-                try:
-                    for fk, fv in filter.items():
-                        if not check_key_value(v[key], fk, fv):
-                            raise ContinueOuter
+        matches = self.__setting_match(setting, filter)
 
-                except AttributeError:
-                    pass
-                except ContinueOuter:
-                    continue
+        for i in matches:
+            self.__settings[i] = None
 
-                del v[key]
+        if matches:
+            self.__index = None
+            self.__touch()
 
     @deprecated('change_entity')
     def add_entity(self, id, count=1, periods=None):
@@ -1060,6 +1863,7 @@ class PlanSpec:
             projection = [projection]
 
         self.__projection = list(set(self.__projection + projection))
+        self.__touch()
 
         for id in targets:
             change = {'target': id}
@@ -1182,6 +1986,59 @@ class PlanSpec:
 
         self.change_entity(EntityAction.REMOVE, targets=[id], projection=periods)
 
+    def derive(self, name=None):
+        """Returns a child specification sharing the settings of this one.
+
+        The child starts with the same scope, settings, and attributes, and
+        records its own changes without affecting this specification, or other
+        children. Settings are shared until modified by either specification,
+        making derivation far cheaper than :func:`copy.deepcopy` when building
+        many similar specifications.
+
+        Args:
+            name (str, optional): Child scenario name. If ``None``, the name of
+                this specification is used.
+
+        Returns:
+            :py:class:`PlanSpec`: Derived specification.
+        """
+        self.__shared.update(id(x) for x in self.__settings)
+
+        child = copy.copy(self)
+        child.__settings = list(self.__settings)
+        child.__index = None
+        child.__shared = set(self.__shared)
+        child.__projection = list(self.__projection)
+        child.__scope = list(self.__scope)
+        child.__dtos = dict(self.__dtos)
+
+        if name is not None:
+            child.name = name
+
+        return child
+
+    def fingerprint(self, version=None):
+        """Returns a hash identifying the scenario content.
+
+        Two specs have the same fingerprint if they produce the same DTO for
+        the same version, regardless of the scenario name.
+
+        Args:
+            version (object, optional): :py:class:`Version` object.
+
+        Returns:
+            str: Hexadecimal SHA-256 digest.
+        """
+        version, entry = self.__dto(version)
+
+        if entry.fingerprint is None:
+            dto = dict(entry.dto)
+            dto.pop('displayName', None)
+            data = json.dumps([version.base_version, dto], sort_keys=True)
+            entry.fingerprint = hashlib.sha256(data.encode()).hexdigest()
+
+        return entry.fingerprint
+
     def get_params(self):
         if self.ignore_constraints:
             return {'ignore_constraints': self.ignore_constraints}
@@ -1197,7 +2054,7 @@ class PlanSpec:
             settings.append({'scope': {'scope': self.__scope}})
 
         settings.append({'type': {'value': self.type.value}})
-        settings.extend(self.__settings)
+        settings.extend(x for x in self.__settings if x is not None)
 
         return settings
 
@@ -1351,6 +2208,8 @@ class PlanSpec:
             targets (list): List of entity or group UUIDs.
             append (bool, optional): If ``True``, scope will be extended. (default: ``False``)
         """
+        self.__touch()
+
         if not targets:
             self.__scope = []
             return
@@ -1375,51 +2234,81 @@ class PlanSpec:
         """Deprecated - see :meth:`.change_max_utilization`"""
         self.change_max_utilization(type=type, value=value, targets=ids)
 
-    def to_json(self, version=None, **kwargs):
+    def to_json(self, version=None, compact=False, **kwargs):
         """Returns the version specific DTO for the scenario.
 
         Args:
             version (object, optional): :py:class:`Version` object.
+            compact (bool, optional): If ``True``, the DTO is returned in the
+                compact wire format, without indentation or whitespace between
+                separators. (default: ``False``)
             **kwargs: Additional JSON processing arguments.
 
         Raises:
             PlanError if no version definition is supplied.
+
+        Note:
+            The DTO is cached per version, and serialized once for each set of
+            JSON processing arguments, until the spec is next modified.
+            Compact DTOs without additional arguments are encoded by the current
+            :py:mod:`~vmtplanner.encoding` backend.
         """
-        def updatemap(d, s):
-            for i in s:
-                d[i] = s[i]
+        if compact:
+            if not kwargs:
+                return self.to_bytes(version).decode()
 
-        version = version if version else self.version
+            kwargs.setdefault('separators', (',', ':'))
 
-        if not version:
-            raise PlanError('Unable to map settings to version type of None')
+        _, entry = self.__dto(version)
 
-        dto = {}
-        fix59 = False
+        try:
+            opts = tuple(sorted(kwargs.items()))
+            res = entry.encoded.get(opts)
+        except TypeError:
+            # unhashable processing arguments are not cached
+            return json.dumps(entry.dto, sort_keys=True, **kwargs)
 
-        # TODO: more elegant solution
-        if vc.VersionSpec.cmp_ver(version.base_version, '6.1.0') >= 0:
-            map = _dto_map_scenario_settings_610
+        if res is None:
+            res = entry.encoded[opts] = json.dumps(entry.dto, sort_keys=True, **kwargs)
 
-            # patches for XL versions
-            if vc.VersionSpec.cmp_ver(version.base_version, '7.20') >= 0:
-                updatemap(map, _dto_map_scenario_settings_720)
-            elif vc.VersionSpec.cmp_ver(version.base_version, '7.19') >= 0:
-                updatemap(map, _dto_map_scenario_settings_719)
+        return res
+
+    def to_bytes(self, version=None):
+        """Returns the version specific DTO for the scenario in the compact wire
+        format, as sent to the server.
+
+        Args:
+            version (object, optional): :py:class:`Version` object.
+
+        Returns:
+            bytes: UTF-8 encoded JSON DTO.
+
+        Raises:
+            PlanError if no version definition is supplied.
+        """
+        _, entry = self.__dto(version)
+        backend = get_backend()
+        res = entry.encoded.get(backend)
+
+        if res is None:
+            res = entry.encoded[backend] = backend.encode(entry.dto)
+
+        return res
+
+    def __build_dto(self, version):
+        dto = {}
+        map, collation = settings_map(version.base_version)
+        settings = self.get_settings()
 
-            settings = self.get_settings()
         # 5.9 support to be removed when classic is deprecated (if ever?)
-        elif vc.VersionSpec.cmp_ver(version.base_version, '5.9.0') >= 0:
-            fix59 = True
-            collation = copy.deepcopy(_scenario_settings_collations_590)
-            map = _dto_map_scenario_settings_590
-            settings = collate_settings(self.get_settings(), collation)
-        else:
-            raise PlanSettingsError(f'No settings map for version: {version.base_version}')
+        fix59 = collation is not None
+
+        if fix59:
+            settings = collate_settings(settings, collation)
 
         for i in settings:
             key = list(i)[0]
-            dto = map_settings(map[key], i[key], dto)
+            dto = compiled_settings(map[key])(i[key], dto)
 
         # fix 5.9 ADDED / ADD_REPEAT
         if fix59:
@@ -1430,7 +2319,7 @@ class PlanSpec:
             except KeyError:
                 pass
 
-        return json.dumps(dto, sort_keys=True, **kwargs)
+        return dto
 
 
 
@@ -1574,11 +2463,9 @@ def resolve_value(var, values):
         except Exception:
             return var
 
+    # the variable may be a map definition, which must not be modified
     if isinstance(var, list):
-        for i, v in enumerate(var):
-            var[i] = resolve_value(v, values)
-
-        return var
+        return [resolve_value(v, values) for v in var]
 
     return var
 
@@ -1629,6 +2516,238 @@ def map_settings(map, values, setting=None):
     return setting
 
 
+def settings_map(base_version):
+    """Returns the scenario settings map for a version.
+
+    Maps are merged from the base map of the version family and any version
+    specific patches once per version, and are read-only, so they may be used
+    by any number of threads.
+
+    Args:
+        base_version (str): Turbonomic base version.
+
+    Returns:
+        tuple: Read-only settings map, and the settings collations required by
+        the version, or ``None``.
+
+    Raises:
+        PlanSettingsError: If the version is not supported.
+    """
+    res = _settings_maps.get(base_version)
+
+    if res is not None:
+        return res
+
+    if vc.VersionSpec.cmp_ver(base_version, '6.1.0') >= 0:
+        map = dict(_dto_map_scenario_settings_610)
+
+        # patches for XL versions
+        if vc.VersionSpec.cmp_ver(base_version, '7.20') >= 0:
+            map.update(_dto_map_scenario_settings_720)
+        elif vc.VersionSpec.cmp_ver(base_version, '7.19') >= 0:
+            map.update(_dto_map_scenario_settings_719)
+
+        res = (MappingProxyType(map), None)
+    elif vc.VersionSpec.cmp_ver(base_version, '5.9.0') >= 0:
+        res = (MappingProxyType(_dto_map_scenario_settings_590),
+               MappingProxyType(_scenario_settings_collations_590))
+    else:
+        raise PlanSettingsError(f'No settings map for version: {base_version}')
+
+    _settings_maps[base_version] = res
+
+    return res
+
+
+def compile_value_map(mapdef):
+    """Compiles a value resolution map into a lookup function.
+
+    Equivalent to :func:`map_value`, with the map definition parsed once.
+
+    Args:
+        mapdef (str): Mapping definition, see :func:`map_value`.
+
+    Returns:
+        callable: Function mapping a value.
+    """
+    pairs = '=' in mapdef
+
+    def prepare(value):
+        if isinstance(value, Enum):
+            return value.value
+        if pairs and isinstance(value, bool):
+            return 'true' if value else 'false'
+
+        return value
+
+    if pairs:
+        table = {}
+        malformed = False
+
+        # pairs after a malformed pair are never reached
+        for x in mapdef.split(';'):
+            try:
+                src, dest = x.split('=')
+            except ValueError:
+                malformed = True
+                break
+
+            table.setdefault(src, dest)
+
+        def lookup(value):
+            value = prepare(value)
+
+            try:
+                if value in table:
+                    return table[value]
+            except TypeError:
+                pass
+
+            if malformed:
+                raise InvalidValueMapError('Value not resolvable for the given value map')
+
+            return value
+
+        return lookup
+
+    try:
+        t, f = mapdef.split(';')
+    except ValueError:
+        def invalid(value):
+            raise InvalidValueMapError('Value not resolvable for the given value map')
+
+        return invalid
+
+    return lambda value: t if prepare(value) else f
+
+
+def compile_value(var):
+    """Compiles a settings map variable into a resolution function.
+
+    Equivalent to :func:`resolve_value` for non-list variables, with ``$`` and
+    ``@`` variables parsed once.
+
+    Args:
+        var: Variable to compile.
+
+    Returns:
+        callable: Function taking the settings values, and returning the
+        resolved value.
+    """
+    if not isinstance(var, str) or not var or var[0] not in '$@':
+        return lambda values: var
+
+    if var[0] == '$':
+        name = var[1:]
+
+        def sub(values):
+            try:
+                return values[name]
+            except Exception:                                                  # pylint: disable=W0703
+                return var
+
+        return sub
+
+    try:
+        name, mapdef = var[1:].split(':')
+    except ValueError:
+        return lambda values: var
+
+    lookup = compile_value_map(mapdef)
+
+    def mapped(values):
+        try:
+            return lookup(values[name])
+        except Exception:                                                      # pylint: disable=W0703
+            return var
+
+    return mapped
+
+
+def compile_settings(map):
+    """Compiles a settings definition into a serializer function.
+
+    Equivalent to :func:`map_settings`, with the definition walked, and its
+    variables parsed, once. Compiled definitions are cached, see
+    :func:`compiled_settings`.
+
+    Args:
+        map (dict): Key value pair mappings for individual setting.
+
+    Returns:
+        callable: Function taking the values to resolve, and optionally the
+        existing settings to update, and returning the modified settings
+        dictionary.
+    """
+    steps = []
+
+    def item(x):
+        if isinstance(x, Mapping):
+            return compile_settings(x)
+
+        # not a valid definition, fails as map_settings does
+        return lambda values, setting=None: map_settings(x, values, setting)
+
+    for k, v in map.items():
+        # nested syntax
+        if isinstance(v, Mapping):
+            steps.append(('nested', k, compile_settings(v), None))
+
+        # list of values
+        elif isinstance(v, list):
+            if '[' in k:
+                group = k[k.find('[')+1:k.find(']')]
+                steps.append(('list', k[0:k.find('[')], [item(x) for x in v], group))
+            else:
+                steps.append(('list', k, [item(x) for x in v], None))
+
+        # simple case
+        else:
+            steps.append(('value', k, compile_value(v), None))
+
+    def serialize(values, setting=None):
+        if setting is None:
+            setting = {}
+
+        for kind, k, func, group in steps:
+            if kind == 'value':
+                setting[k] = func(values)
+            elif kind == 'nested':
+                setting[k] = func(values, setting.get(k, {}))
+            else:
+                if group is not None:
+                    _list = [x(i) for x in func for i in values[group]]
+                else:
+                    _list = [x(values) for x in func]
+
+                if isinstance(setting.get(k, {}), list):
+                    setting[k].extend(_list)
+                else:
+                    setting[k] = _list
+
+        return setting
+
+    return serialize
+
+
+def compiled_settings(map):
+    """Returns the cached compiled serializer of a settings definition.
+
+    Args:
+        map (dict): Key value pair mappings for individual setting.
+
+    Returns:
+        callable: :func:`compile_settings` serializer function.
+    """
+    # keyed by identity, the definition is held to keep its id unique
+    entry = _compiled_settings.get(id(map))
+
+    if entry is None or entry[0] is not map:
+        entry = _compiled_settings[id(map)] = (map, compile_settings(map))
+
+    return entry[1]
+
+
 def collate_settings(s, c):
     """Collates fields across settings entries based on a collation mapping.
 
@@ -0,0 +1,360 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+import asyncio
+import contextvars
+import datetime
+from functools import partial
+import inspect
+import traceback
+
+import vmtconnect as vc
+
+from vmtplanner import (Plan, PlanContext, PlanError, PlanExecutionExceeded,
+                        PlanRunning, MarketState)
+
+
+
+class AsyncPlan(Plan):
+    """asyncio plan instance.
+
+    Provides the same plan engine as :py:class:`~vmtplanner.Plan`, with the
+    run, stop, and delete operations exposed as coroutines. Status polling waits
+    on the event loop instead of blocking a thread, allowing many plans to be
+    driven from a single loop. Individual API requests are dispatched to the
+    loop's executor, as :py:class:`~vmtconnect.Connection` is synchronous.
+
+    Args:
+        connection (:py:class:`~vmtconnect.Connection`): :py:class:`~vmtconnect.Connection` or :py:class:`~vmtconnect.Session`.
+        spec (:py:class:`~vmtplanner.PlanSpec`, optional): Settings to apply to
+            the market, if running a plan.
+        market (str, optional): Base market UUID to apply the settings to.
+        name (str, optional): Plan display name.
+        executor (:py:class:`~concurrent.futures.Executor`, optional): Executor
+            used for API requests and synchronous hooks. If ``None``, the loop's
+            default executor is used.
+
+    Note:
+        Each plan makes its requests on its own shallow copy of the connection,
+        as :py:class:`~vmtconnect.Connection` keeps per-request state, and
+        requests of concurrent plans run on separate executor threads.
+
+        Hooks may be regular functions or coroutine functions. Regular functions
+        are run in the executor.
+
+        Cancelling a running :meth:`run` stops the plan market on the server
+        before the cancellation is propagated.
+    """
+    def __init__(self, connection, *args, executor=None, **kwargs):
+        super().__init__(PlanContext.copy_connection(connection), *args, **kwargs)
+        self.executor = executor
+
+    async def _call(self, func, *args, **kwargs):
+        # runs blocking calls off the loop, awaiting coroutine results; the
+        # context is copied so requests are counted towards the plan metrics
+        loop = asyncio.get_event_loop()
+        ctx = contextvars.copy_context()
+        res = await loop.run_in_executor(self.executor, ctx.run, partial(func, *args, **kwargs))
+
+        if inspect.isawaitable(res):
+            res = await res
+
+        return res
+
+    async def __hook(self, metrics, name):
+        # the phase is timed until the hook completes, coroutine hooks are
+        # awaited on the loop
+        hook = self._hook(name)
+
+        if hook is None:
+            return self.result if name == 'post_hook' else None
+
+        with metrics.phase(name):
+            if inspect.iscoroutinefunction(hook.name):
+                return await hook.name(*hook.args)
+
+            return await self._call(hook.name, *hook.args)
+
+    async def __wait_for_stop(self):
+        wait = min(self.spec.abort_poll_freq, self.spec.abort_timeout)
+        start = datetime.datetime.now()
+
+        while True:
+            snapshot = await self.poll()
+
+            if snapshot.state in (MarketState.SUCCEEDED, MarketState.STOPPED):
+                return True
+
+            run_time = (datetime.datetime.now() - start).total_seconds() / 60
+
+            if run_time > self.spec.abort_timeout:
+                break
+
+            await asyncio.sleep(wait)
+
+        raise PlanError
+
+    async def __abort(self):
+        try:
+            await self.stop()
+        except vc.HTTP502Error:
+            pass
+        except vc.HTTP500Error:
+            raise PlanError('Server error stopping plan')
+        except vc.HTTPError:
+            raise PlanError('Plan stop command error')
+
+        raise PlanExecutionExceeded(f'Plan execution time exceeded maximum allowed, market state: {self.snapshot.state}')
+
+    async def __wait_for_poller(self):
+        future = asyncio.wrap_future(self.poller.watch(self))
+
+        try:
+            await asyncio.wait_for(future, self._remaining())
+        except asyncio.TimeoutError:
+            self.poller.unwatch(self)
+            await self.__abort()
+        except asyncio.CancelledError:
+            self.poller.unwatch(self)
+            raise
+
+    async def __stage(self, policy, func, stage):
+        # retries transient stage errors without blocking the loop
+        tries = 0
+
+        while True:
+            try:
+                return await self._call(func)
+            except policy.transient as e:
+                tries += 1
+
+                if tries >= policy.stage_retry:
+                    raise
+
+                wait = policy.delay(tries)
+                self.log(f'Retrying {stage} in {wait:.1f}s ({tries}/{policy.stage_retry}): {e}', level='debug')
+                await asyncio.sleep(wait)
+
+    async def __wait_for_plan(self, policy):
+        if self.poller is not None:
+            return await self.__wait_for_poller()
+
+        passes = 0
+
+        while True:
+            snapshot = await self.__stage(policy, self.refresh, 'poll')
+
+            if self._check_progress(snapshot.state, passes):
+                break
+            elif self._is_expired():
+                await self.__abort()
+            else:
+                await asyncio.sleep(self._poll_wait())
+                passes += 1
+
+    async def __cancel(self):
+        try:
+            await self.stop()
+        except Exception as e:                                                 # pylint: disable=W0703
+            self.log(f'Unable to stop cancelled plan [{self.market_id}]: {e}', level='warn')
+
+    async def __run(self, policy):
+        if self.scenario_id is None:
+            await self.__stage(policy, self._init_scenario, 'scenario')
+        elif self._scenario_stale:
+            await self.__stage(policy, self._sync_scenario, 'scenario')
+
+        # the market request cannot be recalled once sent, so it is shielded
+        # from cancellation and the new market stopped instead
+        market = asyncio.ensure_future(self.__stage(policy, self._init_market, 'market'))
+
+        try:
+            await asyncio.shield(market)
+        except asyncio.CancelledError:
+            await market
+            self._mark_started()
+            await self.__cancel()
+            raise
+
+        self._mark_started()
+
+        try:
+            await self.__wait_for_plan(policy)
+        except asyncio.CancelledError:
+            await self.__cancel()
+            raise
+
+        return await self._call(self._finish)
+
+    async def init_scenario(self):
+        """Creates the plan scenario.
+
+        Returns:
+            str: Scenario UUID.
+        """
+        return await self._call(self._init_scenario)
+
+    async def init_market(self):
+        """Creates the plan market from the scenario.
+
+        Returns:
+            str: Market UUID.
+        """
+        return await self._call(self._init_market)
+
+    async def poll(self):
+        """Fetches the market from the server.
+
+        Returns:
+            :py:class:`~vmtplanner.MarketSnapshot`: Current market data.
+        """
+        return await self._call(self.refresh)
+
+    async def get_stats(self):
+        """Returns statistics for the market.
+
+        Returns:
+            list: A list of statistics by period.
+        """
+        return await self._call(super().get_stats)
+
+    async def run(self):
+        """Runs the market with currently applied scenario and settings.
+
+        Raises:
+            PlanRunning if the plan is already being run.
+            PlanError if retry limit is reached.
+        """
+        with self._tracked() as metrics:
+            self.result = None
+            await self.__hook(metrics, 'pre_hook')
+
+            cached = await self._call(self._cache_lookup)
+
+            if cached is not None:
+                return cached.result
+
+            policy = self._retry_policy()
+            run = 0
+            trace = None
+            self._reset_stages()
+
+            while run < policy.max_retry:
+                metrics.begin_attempt()
+
+                try:
+                    self.result = await self.__run(policy)
+                    metrics.end_attempt()
+                    break
+                except (PlanError, *policy.transient) as e:
+                    metrics.end_attempt(e)
+                    trace = traceback.format_exc()
+                    run += 1
+                    await self._call(self._abandon_market, policy)
+
+                    if run < policy.max_retry:
+                        await asyncio.sleep(policy.delay(run))
+
+            if not self.result:
+                raise PlanError(f'Retry limit reached. Last error:\n{trace}')
+
+            ret = await self.__hook(metrics, 'post_hook')
+            await self._call(self._cache_result, ret)
+
+            return ret
+
+    async def resume(self):
+        """Completes a plan attached with :meth:`~vmtplanner.Plan.from_market`.
+
+        Returns:
+            The post processing hook result, or the final market state.
+
+        Raises:
+            PlanRunning if the plan is already being run.
+        """
+        with self._tracked(run_id=self.run_id) as metrics:
+            metrics.begin_attempt()
+
+            try:
+                metrics.enter('queued')
+                snapshot = await self.poll()
+
+                if not self._check_progress(snapshot.state, 0):
+                    await self.__wait_for_plan(self._retry_policy())
+
+                self.result = await self._call(self._finish)
+            except BaseException as e:
+                metrics.end_attempt(e)
+                raise
+
+            metrics.end_attempt()
+
+            return await self.__hook(metrics, 'post_hook')
+
+    def submit(self, executor=None):
+        """Schedules :meth:`run` on the running event loop.
+
+        Args:
+            executor: Ignored, present for :py:class:`~vmtplanner.Plan` compatibility.
+
+        Returns:
+            :py:class:`asyncio.Task`: Task resolving to the :meth:`run` result.
+            Cancelling the task stops the plan.
+
+        Raises:
+            PlanRunning: If the plan is already running.
+        """
+        if self._running.locked():
+            raise PlanRunning(f'Plan [{self.market_name}] is already running')
+
+        return asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        """Stops the market.
+
+        Returns:
+            bool: ``True`` upon success. Raises an exception otherwise.
+
+        Raises:
+            vmtconnect.HTTP500Error
+            PlanError: Error stopping plan
+        """
+        try:
+            await self._call(self._request_stop)
+            await self.__wait_for_stop()
+            self._record_duration()
+
+        except (vc.HTTP500Error, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            raise PlanError(f'Error stopping plan: {e}')
+
+        return True
+
+    async def delete(self, scenario=True):
+        """Removes the market, and the scenario.
+
+        Args:
+            scenario (bool, optional): If ``True``, removes the scenario as well. (default: ``True``)
+
+        Returns:
+            bool: ``True`` upon success, ``False`` otherwise.
+
+        Raises:
+            InvalidMarketError: Attempting to delete system market
+            InvalidMarketError: Market does not exist
+            PlanDeprovisionError: Error removing the plan
+        """
+        return await self._call(super().delete, scenario)
@@ -0,0 +1,499 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import copy
+import threading
+import time
+import weakref
+
+import umsg.mixins
+
+
+
+class _ScenarioEntry:
+    __slots__ = ['key', 'uuid', 'name', 'created', 'refs']
+
+    def __init__(self, key, uuid, name):
+        self.key = key
+        self.uuid = uuid
+        self.name = name
+        self.created = time.monotonic()
+        self.refs = weakref.WeakSet()
+
+
+class ScenarioCache(umsg.mixins.LoggingMixin):
+    """Plan scenario reuse cache.
+
+    Plans sharing a cache reuse an existing server scenario, in place of
+    creating a new one, when their :py:class:`~vmtplanner.PlanSpec` produces the
+    same DTO for the same target version (see :meth:`~vmtplanner.PlanSpec.fingerprint`).
+    Cached scenarios are owned by the cache:
+
+    * :meth:`Plan.delete(scenario=False) <vmtplanner.Plan.delete>` removes only
+      the plan market, as usual.
+    * :meth:`Plan.delete(scenario=True) <vmtplanner.Plan.delete>` releases the
+      plan's reference, and the scenario is removed only once it is expired
+      and no other plan references it.
+    * A plan rerun with a different scenario releases its reference to the
+      previous one, as does a plan which is garbage collected.
+    * :meth:`prune` removes expired, unreferenced scenarios, and :meth:`clear`
+      removes them all.
+
+    Args:
+        ttl (int, optional): Seconds a cached scenario may be reused by new
+            plans, 0 = unlimited. (default: ``3600``)
+
+    Example:
+        .. code-block:: python
+
+           cache = ScenarioCache()
+
+           for x in range(10):
+               plan = vp.Plan(vmt, spec)
+               plan.scenario_cache = cache
+               plan.run()
+               plan.delete()
+    """
+    def __init__(self, ttl=3600):
+        super().__init__()
+        self.ttl = ttl
+        self.__entries = {}
+        self.__ids = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def key(plan):
+        """Returns the cache key for a plan.
+
+        Args:
+            plan (:py:class:`~vmtplanner.Plan`): Plan to key.
+
+        Returns:
+            tuple: Instance host and scenario fingerprint.
+        """
+        return (getattr(plan._vmt, 'host', None), plan.spec.fingerprint())
+
+    def __expired(self, entry):
+        return self.ttl > 0 and time.monotonic() - entry.created > self.ttl
+
+    def __remove(self, entry):
+        self.__ids.pop(entry.uuid, None)
+
+        if self.__entries.get(entry.key) is entry:
+            del self.__entries[entry.key]
+
+    def __delete(self, connection, entry):
+        try:
+            connection.del_scenario(entry.uuid)
+        except Exception as e:                                                 # pylint: disable=W0703
+            self.log(f'Unable to remove cached scenario [{entry.uuid}]: {e}', level='warn')
+
+    def acquire(self, plan, key=None):
+        """Returns a reusable scenario for the plan, and references it.
+
+        Args:
+            plan (:py:class:`~vmtplanner.Plan`): Plan requiring a scenario.
+            key (tuple, optional): Precomputed :meth:`key`.
+
+        Returns:
+            tuple: Scenario UUID and name, or ``None`` if there is no usable
+            scenario.
+        """
+        key = key or self.key(plan)
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is None or self.__expired(entry):
+                return None
+
+            entry.refs.add(plan)
+
+            return entry.uuid, entry.name
+
+    def add(self, plan, uuid, name, key=None):
+        """Adds a newly created scenario to the cache, referenced by the plan.
+
+        Args:
+            plan (:py:class:`~vmtplanner.Plan`): Plan that created the scenario.
+            uuid (str): Scenario UUID.
+            name (str): Scenario name.
+            key (tuple, optional): Precomputed :meth:`key`.
+
+        Returns:
+            bool: ``True`` if cached, ``False`` if an equivalent scenario is
+            already cached, in which case the plan retains ownership.
+        """
+        key = key or self.key(plan)
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is not None and not self.__expired(entry):
+                return False
+
+            entry = self.__entries[key] = self.__ids[uuid] = _ScenarioEntry(key, uuid, name)
+            entry.refs.add(plan)
+
+        return True
+
+    def owns(self, uuid):
+        """Returns ``True`` if the scenario is managed by the cache."""
+        with self.__lock:
+            return uuid in self.__ids
+
+    def discard(self, uuid):
+        """Forgets a scenario without removing it from the server, i.e. when it
+        was removed externally.
+
+        Returns:
+            bool: ``True`` if the scenario was cached.
+        """
+        with self.__lock:
+            entry = self.__ids.get(uuid)
+
+            if entry is None:
+                return False
+
+            self.__remove(entry)
+
+        return True
+
+    def release(self, plan, uuid, remove=True):
+        """Releases a plan's reference to a cached scenario.
+
+        The scenario is removed from the server if it is expired, or no longer
+        the current scenario for its key, and is not referenced by other plans.
+
+        Args:
+            plan (:py:class:`~vmtplanner.Plan`): Plan releasing the scenario.
+            uuid (str): Scenario UUID.
+            remove (bool, optional): If ``False``, the scenario is kept on the
+                server even if it is no longer usable. (default: ``True``)
+
+        Returns:
+            bool: ``True`` if the scenario is cached.
+        """
+        with self.__lock:
+            entry = self.__ids.get(uuid)
+
+            if entry is None:
+                return False
+
+            entry.refs.discard(plan)
+            stale = self.__expired(entry) or self.__entries.get(entry.key) is not entry
+            remove = remove and stale and not entry.refs
+
+            if remove:
+                self.__remove(entry)
+
+        if remove:
+            self.__delete(plan._vmt, entry)
+
+        return True
+
+    def prune(self, connection):
+        """Removes expired scenarios which are no longer referenced.
+
+        Args:
+            connection (:py:class:`~vmtconnect.Connection`): Connection the
+                scenarios belong to.
+        """
+        self.clear(connection, expired=True)
+
+    def clear(self, connection=None, expired=False):
+        """Empties the cache.
+
+        Args:
+            connection (:py:class:`~vmtconnect.Connection`, optional): If given,
+                unreferenced scenarios belonging to the connection are removed
+                from the server, otherwise they are only forgotten.
+            expired (bool, optional): If ``True``, only expired scenarios are
+                cleared. (default: ``False``)
+        """
+        host = getattr(connection, 'host', None)
+
+        with self.__lock:
+            entries = [x for x in self.__ids.values()
+                       if (not expired or self.__expired(x))
+                       and (connection is None or x.key[0] == host)]
+
+            for x in entries:
+                self.__remove(x)
+
+        if connection is not None:
+            for x in entries:
+                if not x.refs:
+                    self.__delete(connection, x)
+
+
+
+class EntityCache:
+    """Entity metadata cache.
+
+    Holds the display name and class name of entities, groups, and clusters
+    looked up by UUID, for reuse across plans. Missing entries are fetched
+    concurrently, each worker using its own shallow copy of the connection, as
+    :py:class:`~vmtconnect.Connection` keeps per-request state.
+
+    Args:
+        ttl (int, optional): Seconds an entry remains valid, 0 = unlimited.
+            (default: ``3600``)
+        workers (int, optional): Maximum concurrent lookups. (default: ``8``)
+
+    Example:
+        .. code-block:: python
+
+           cache = EntityCache()
+           meta = cache.lookup(vmt, ['<uuid1>', '<uuid2>'])
+           print(meta['<uuid1>']['displayName'])
+    """
+    def __init__(self, ttl=3600, workers=8):
+        self.ttl = ttl
+        self.workers = workers
+        self.__entries = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @staticmethod
+    def __fetch(connection, uuid):
+        ent = connection.search(uuid=uuid)[0]
+
+        return {'displayName': ent['displayName'], 'className': ent['className']}
+
+    def __fetch_all(self, connection, uuids):
+        if len(uuids) == 1 or self.workers <= 1:
+            return [self.__fetch(connection, x) for x in uuids]
+
+        local = threading.local()
+
+        def fetch(uuid):
+            if not hasattr(local, 'conn'):
+                local.conn = copy.copy(connection)
+
+            return self.__fetch(local.conn, uuid)
+
+        # each lookup carries the caller's context, for request accounting
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(uuids))) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, fetch, x) for x in uuids]
+
+            return [x.result() for x in futures]
+
+    def lookup(self, connection, uuids):
+        """Returns metadata for the given UUIDs, fetching any not cached.
+
+        Args:
+            connection (:py:class:`~vmtconnect.Connection`): Connection to
+                fetch missing entries with.
+            uuids (list): Entity, group, or cluster UUIDs.
+
+        Returns:
+            dict: UUID keyed dictionaries of ``displayName`` and ``className``.
+        """
+        host = getattr(connection, 'host', None)
+        now = time.monotonic()
+        res = {}
+        missing = []
+
+        with self.__lock:
+            for x in uuids:
+                entry = self.__entries.get((host, x))
+
+                if entry is not None and (self.ttl <= 0 or now - entry[0] < self.ttl):
+                    res[x] = entry[1]
+                elif x not in res and x not in missing:
+                    missing.append(x)
+
+        if missing:
+            fetched = self.__fetch_all(connection, missing)
+            now = time.monotonic()
+
+            with self.__lock:
+                for x, meta in zip(missing, fetched):
+                    self.__entries[(host, x)] = (now, meta)
+                    res[x] = meta
+
+        return res
+
+    def clear(self):
+        """Empties the cache."""
+        with self.__lock:
+            self.__entries.clear()
+
+
+
+class _ResultEntry:
+    __slots__ = ['state', 'snapshot', 'stats', 'result', 'created']
+
+    def __init__(self, state, snapshot, stats, result):
+        self.state = state
+        self.snapshot = snapshot
+        self.stats = stats
+        self.result = result
+        self.created = time.monotonic()
+
+
+class ResultCache(umsg.mixins.LoggingMixin):
+    """Plan result cache.
+
+    Plans sharing a cache return the outcome of an earlier, successful run in
+    place of running a new market, when the run was made within the freshness
+    window by the same plan class, against the same base market, using a
+    :py:class:`~vmtplanner.PlanSpec` which produces the same DTO (see
+    :meth:`~vmtplanner.PlanSpec.fingerprint`). The final
+    :py:class:`~vmtplanner.MarketState`, the market snapshot, the
+    :meth:`~vmtplanner.Plan.get_stats` output, and the post processing hook
+    result are cached.
+
+    Plans returning a cached result do not own a market, their
+    :py:attr:`~vmtplanner.Plan.market_id` is ``None``, and they are not
+    :py:attr:`~vmtplanner.Plan.initialized`. Post processing results are
+    shared between plans, and should be treated as read-only. Once
+    ``max_entries`` is reached, the least recently used result is dropped.
+
+    Args:
+        ttl (int, optional): Seconds a result remains fresh, as the topology
+            may change in the meantime, 0 = unlimited. (default: ``900``)
+        stats (bool, optional): If ``True``, market statistics are fetched and
+            cached with each result. (default: ``True``)
+        max_entries (int, optional): Maximum results held, 0 = unlimited.
+            (default: ``256``)
+
+    Example:
+        .. code-block:: python
+
+           results = ResultCache(ttl=3600)
+
+           plan = ClusterHeadroom(vmt)
+           plan.result_cache = results
+           plan.run()
+           print(plan.headroom())
+    """
+    def __init__(self, ttl=900, stats=True, max_entries=256):
+        super().__init__()
+        self.ttl = ttl
+        self.stats = stats
+        self.max_entries = max_entries
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__entries)
+
+    @staticmethod
+    def key(plan):
+        """Returns the cache key for a plan.
+
+        Args:
+            plan (:py:class:`~vmtplanner.Plan`): Plan to key.
+
+        Returns:
+            tuple: Instance host, plan class, base market, scenario fingerprint,
+            and any plan specific post processing parameters.
+        """
+        return (getattr(plan._vmt, 'host', None), type(plan).__qualname__,
+                plan.base_market, plan.spec.fingerprint(), plan._result_key())
+
+    def __expired(self, entry):
+        return self.ttl > 0 and time.monotonic() - entry.created > self.ttl
+
+    def get(self, plan, key=None):
+        """Returns the fresh cached result for a plan.
+
+        Args:
+            plan (:py:class:`~vmtplanner.Plan`): Plan to be run.
+            key (tuple, optional): Precomputed :meth:`key`.
+
+        Returns:
+            Cached result entry, or ``None`` if there is no fresh result.
+        """
+        key = key or self.key(plan)
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is None:
+                return None
+
+            if self.__expired(entry):
+                del self.__entries[key]
+                return None
+
+            self.__entries.move_to_end(key)
+
+            return entry
+
+    def add(self, plan, result, key=None):
+        """Caches the result of a successfully completed plan run.
+
+        Args:
+            plan (:py:class:`~vmtplanner.Plan`): Completed plan.
+            result: Post processing hook result returned by the run.
+            key (tuple, optional): Precomputed :meth:`key`.
+
+        Returns:
+            bool: ``True`` if cached, ``False`` if the statistics could not be
+            fetched.
+        """
+        key = key or self.key(plan)
+        stats = None
+
+        if self.stats:
+            try:
+                stats = plan._vmt.get_market_stats(plan.market_id)
+            except Exception as e:                                             # pylint: disable=W0703
+                self.log(f'Unable to fetch stats for [{plan.market_id}]: {e}', level='warn')
+                return False
+
+        with self.__lock:
+            self.__entries[key] = _ResultEntry(plan.result, plan.snapshot, stats, result)
+            self.__entries.move_to_end(key)
+
+            while self.max_entries > 0 and len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+        return True
+
+    def invalidate(self, plan):
+        """Removes the cached result for a plan, if any.
+
+        Returns:
+            bool: ``True`` if a result was removed.
+        """
+        key = self.key(plan)
+
+        with self.__lock:
+            return self.__entries.pop(key, None) is not None
+
+    def prune(self):
+        """Removes expired results."""
+        with self.__lock:
+            for k in [k for k, v in self.__entries.items() if self.__expired(v)]:
+                del self.__entries[k]
+
+    def clear(self):
+        """Empties the cache."""
+        with self.__lock:
+            self.__entries.clear()
+
+
+#: Default entity cache shared by all plans.
+entity_cache = EntityCache()
@@ -0,0 +1,200 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+from collections import namedtuple
+
+import umsg.mixins
+
+from vmtplanner import EntityAction, MarketState, Plan
+from vmtplanner.pool import PlanPool
+
+
+
+CapacityProbe = namedtuple('CapacityProbe', [
+    'count',
+    'fits',
+    'result'
+])
+CapacityProbe.__doc__ = """Capacity search probe.
+
+Attributes:
+    count (int): Number of template copies added.
+    fits (bool): ``True`` if the plan succeeded with no unplaced entities.
+    result (:py:class:`~vmtplanner.pool.PlanResult`): Probe plan result.
+"""
+
+CapacityResult = namedtuple('CapacityResult', [
+    'count',
+    'limit',
+    'probes'
+])
+CapacityResult.__doc__ = """Capacity search result.
+
+Attributes:
+    count (int): Largest number of template copies found to fit.
+    limit (int): Smallest number of copies found not to fit, or ``None`` if
+        the maximum count fits.
+    probes (list): :py:class:`CapacityProbe` results, in the order run.
+"""
+
+
+class CapacitySearch(umsg.mixins.LoggingMixin):
+    """Template capacity search.
+
+    Finds the largest number of copies of a template which may be added to the
+    plan scope with no unplaced entities. Probe plans add copies with
+    :meth:`~vmtplanner.PlanSpec.change_entity` to a specification derived from
+    the base specification. The count is doubled from ``start`` until a probe
+    does not fit, or ``max_count`` is reached, after which the interval between
+    the largest fitting and smallest failing counts is narrowed to ``precision``.
+
+    Each round runs ``workers`` probes concurrently: doubling probes the next
+    ``workers`` powers of two, and narrowing splits the interval into
+    ``workers + 1`` parts. The search requires roughly log2(N) probes with a
+    single worker, and fewer rounds with more.
+
+    Args:
+        connection (:py:class:`~vmtconnect.Connection`): Connection to run
+            probes with. Each probe uses its own shallow copy.
+        spec (:py:class:`~vmtplanner.PlanSpec`): Base plan specification,
+            providing the scope and any other changes.
+        template (str): Template UUID to add copies of.
+        start (int, optional): First count probed. (default: ``8``)
+        max_count (int, optional): Largest count probed. (default: ``10000``)
+        precision (int, optional): Search interval at which to stop, 1 = exact.
+            (default: ``1``)
+        workers (int, optional): Concurrent probe plans. (default: ``2``)
+        projection (list, optional): Periods to add copies in. (default: ``[0]``)
+        plan_class (class, optional): :py:class:`~vmtplanner.Plan` class used
+            for probes. (default: :py:class:`~vmtplanner.Plan`)
+        cleanup (bool, optional): If ``True``, probe markets and scenarios are
+            removed as each probe finishes. (default: ``True``)
+        **kwargs: Additional plan class arguments.
+
+    Example:
+        .. code-block:: python
+
+           spec = vp.PlanSpec(scope=[cluster_uuid])
+           res = CapacitySearch(vmt, spec, template_uuid, workers=3).search()
+           print(f'{res.count} VMs fit, using {len(res.probes)} plans')
+    """
+    def __init__(self, connection, spec, template, start=8, max_count=10000,
+                 precision=1, workers=2, projection=None, plan_class=Plan,
+                 cleanup=True, **kwargs):
+        super().__init__()
+
+        if start < 1 or max_count < 1 or precision < 1 or workers < 1:
+            raise ValueError('start, max_count, precision and workers must be 1 or greater')
+
+        self._vmt = connection
+        self.spec = spec
+        self.template = template
+        self.start = start
+        self.max_count = max_count
+        self.precision = precision
+        self.workers = workers
+        self.projection = projection or [0]
+        self.plan_class = plan_class
+        self.cleanup = cleanup
+        self.kwargs = kwargs
+
+    def _probe_spec(self, count):
+        spec = self.spec.derive()
+        spec.change_entity(EntityAction.ADD, targets=[self.template],
+                           count=count, projection=self.projection)
+
+        return spec
+
+    @staticmethod
+    def _fits(result):
+        return result.state == MarketState.SUCCEEDED and not result.plan.unplaced_entities
+
+    def __probe_all(self, pool, counts):
+        futures = [(x, pool.submit(self._vmt, self._probe_spec(x), **self.kwargs))
+                   for x in counts]
+        res = []
+
+        for count, future in futures:
+            result = future.result()
+
+            if result.error is not None:
+                raise result.error
+
+            res.append(CapacityProbe(count, self._fits(result), result))
+            self.log(f'Probe [{count}] {"fits" if res[-1].fits else "does not fit"}', level='debug')
+
+        return res
+
+    def __next_counts(self, low, high):
+        if high is None:
+            # doubling, until a probe fails
+            first = low * 2 if low else self.start
+
+            return sorted({min(first * 2 ** x, self.max_count) for x in range(self.workers)})
+
+        # narrowing, split the interval evenly
+        step = (high - low) / (self.workers + 1)
+
+        return sorted({min(low + max(round(step * (x + 1)), 1), high - 1)
+                       for x in range(self.workers)})
+
+    def probe(self, count):
+        """Runs a single probe plan.
+
+        Args:
+            count (int): Number of template copies to add.
+
+        Returns:
+            :py:class:`CapacityProbe`: Probe result.
+        """
+        with PlanPool(max_markets=1, plan_class=self.plan_class, cleanup=self.cleanup) as pool:
+            return self.__probe_all(pool, [count])[0]
+
+    def search(self):
+        """Runs the capacity search.
+
+        Returns:
+            :py:class:`CapacityResult`: Search result.
+
+        Raises:
+            The error of any probe plan which fails to run.
+        """
+        low = 0
+        high = None
+        probes = []
+
+        with PlanPool(max_markets=self.workers, plan_class=self.plan_class,
+                      cleanup=self.cleanup) as pool:
+            while True:
+                if high is None and low >= self.max_count:
+                    break
+
+                if high is not None and high - low <= self.precision:
+                    break
+
+                res = self.__probe_all(pool, self.__next_counts(low, high))
+                probes.extend(res)
+
+                for x in res:
+                    if not x.fits and (high is None or x.count < high):
+                        high = x.count
+
+                for x in res:
+                    if x.fits and x.count > low and (high is None or x.count < high):
+                        low = x.count
+
+        self.log(f'Capacity of [{self.template}] is {low} copies, {len(probes)} probes', level='debug')
+
+        return CapacityResult(low, high, probes)
@@ -0,0 +1,317 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import datetime
+import re
+import threading
+import time
+
+import umsg.mixins
+
+from vmtplanner import _SYSTEM_MARKETS, InvalidMarketError, MarketState
+
+
+
+CollectResult = namedtuple('CollectResult', [
+    'markets',
+    'scenarios',
+    'errors'
+])
+CollectResult.__doc__ = """Market collection result.
+
+Attributes:
+    markets (list): UUIDs of markets removed.
+    scenarios (list): UUIDs of scenarios removed.
+    errors (dict): UUID keyed exceptions for objects which could not be removed.
+"""
+
+
+class _RateLimiter:
+    # spaces calls evenly at no more than rate per second, across threads
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate and rate > 0 else 0
+        self.__next = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+
+        with self.__lock:
+            now = time.monotonic()
+            slot = max(self.__next, now)
+            self.__next = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class MarketCollector(umsg.mixins.LoggingMixin):
+    """Plan market garbage collector.
+
+    Finds plan markets, and their scenarios, left on the server by previous
+    plan runs, and removes them concurrently at a limited request rate. Markets
+    are selected by display name prefix, age, and state. System markets are
+    never selected, nor removed.
+
+    Scenarios of removed markets are removed as well, unless still used by a
+    remaining market. Scenarios not used by any market, and matching the name
+    prefixes, are only removed if ``orphans`` is set. Such scenarios may belong
+    to plans currently starting, or be held by a
+    :py:class:`~vmtplanner.cache.ScenarioCache` or
+    :py:class:`~vmtplanner.warm.WarmPool`, so orphan collection should only be
+    performed while no plans are being run.
+
+    A ``min_age`` is required to remove anything with :meth:`collect`, as
+    markets of plans currently being run by other clients are otherwise
+    selected. Market age is taken from the run date. Markets which never
+    started have none, and are aged by the creation time in generated plan
+    market names, or else from when the collector first saw them.
+
+    Args:
+        connection (:py:class:`~vmtconnect.Connection`): Connection to collect on.
+        prefixes (list, optional): Market and scenario name prefixes to collect.
+            (default: :py:attr:`PREFIXES`)
+        min_age (int, optional): Minimum age in seconds of markets to collect.
+            (default: ``3600``)
+        states (list, optional): :py:class:`~vmtplanner.MarketState` values of
+            markets to collect. (default: :py:attr:`STATES`)
+        scenarios (bool, optional): If ``False``, scenarios are not removed.
+            (default: ``True``)
+        orphans (bool, optional): If ``True``, scenarios not used by any market
+            are removed as well. (default: ``False``)
+        workers (int, optional): Maximum concurrent removals. (default: ``4``)
+        rate (float, optional): Maximum removal requests per second, 0 =
+            unlimited. (default: ``5``)
+
+    Example:
+        .. code-block:: python
+
+           gc = MarketCollector(vmt, min_age=86400)
+           res = gc.collect()
+           print(f'Removed {len(res.markets)} markets')
+    """
+    #: Default name prefixes, matching generated plan and headroom names.
+    PREFIXES = ('CUSTOM_', 'Custom Headroom Plan')
+
+    #: Default market states, excludes markets being set up or running.
+    STATES = (MarketState.STOPPED, MarketState.SUCCEEDED, MarketState.USER_STOPPED)
+
+    __datetime_format = "%Y-%m-%dT%H:%M:%S%z"
+    __name_time = re.compile(r'(?:^|[_ ])(\d{10})(?=[_ ]|$)')
+
+    def __init__(self, connection, prefixes=PREFIXES, min_age=3600, states=STATES,
+                 scenarios=True, orphans=False, workers=4, rate=5):
+        super().__init__()
+        self._vmt = connection
+        self.prefixes = tuple(prefixes)
+        self.min_age = min_age
+        self.states = states
+        self.scenarios = scenarios
+        self.orphans = orphans
+        self.workers = workers
+        self.rate = rate
+        self.__protected = None
+        self.__seen = {}
+
+    def __protected_ids(self):
+        # realtime market UUID, in addition to the system market names
+        if self.__protected is None:
+            self.__protected = set(_SYSTEM_MARKETS)
+            self.__protected.add(self._vmt.get_markets(uuid='Market')[0]['uuid'])
+
+        return self.__protected
+
+    def __is_system(self, market):
+        protected = self.__protected_ids()
+
+        return market.get('uuid') in protected or market.get('displayName') in protected
+
+    def __age(self, obj):
+        try:
+            date = datetime.datetime.strptime(obj['runDate'], self.__datetime_format)
+            return (datetime.datetime.now(date.tzinfo) - date).total_seconds()
+        except (KeyError, TypeError, ValueError):
+            pass
+
+        # generated names carry the creation time as an epoch timestamp
+        match = self.__name_time.findall(str(obj.get('displayName', '')))
+
+        if match:
+            return time.time() - int(match[-1])
+
+        self.log(f'Market [{obj.get("uuid")}] has no run date, aging from first seen', level='debug')
+        now = time.monotonic()
+
+        return now - self.__seen.setdefault(obj.get('uuid'), now)
+
+    def __selected(self, market):
+        if self.__is_system(market):
+            return False
+
+        if not str(market.get('displayName', '')).startswith(self.prefixes):
+            return False
+
+        if self.states is not None:
+            try:
+                if MarketState[market['state']] not in self.states:
+                    return False
+            except KeyError:
+                return False
+
+        if self.min_age:
+            age = self.__age(market)
+
+            if age < self.min_age:
+                return False
+
+        return True
+
+    def find_markets(self, markets=None):
+        """Returns the markets eligible for collection.
+
+        Args:
+            markets (list, optional): Market DTOs to filter. If ``None``, all
+                markets are fetched from the server.
+
+        Returns:
+            list: Market DTOs.
+        """
+        if markets is None:
+            markets = self._vmt.get_markets(fetch_all=True)
+
+        return [x for x in markets if self.__selected(x)]
+
+    def find_scenarios(self, markets=None, all_markets=None):
+        """Returns the scenarios eligible for collection.
+
+        Includes the scenarios of the given markets which are not used by any
+        other market, and if ``orphans`` is set, scenarios matching the
+        name prefixes which are not used by any market.
+
+        Args:
+            markets (list, optional): Market DTOs selected for collection. If
+                ``None``, :meth:`find_markets` is used.
+            all_markets (list, optional): All market DTOs on the server. If
+                ``None``, markets are fetched from the server.
+
+        Returns:
+            list: Scenario UUIDs.
+        """
+        if all_markets is None:
+            all_markets = self._vmt.get_markets(fetch_all=True)
+
+        if markets is None:
+            markets = self.find_markets(all_markets)
+
+        removed = {x['uuid'] for x in markets}
+        used = {x['scenario']['uuid'] for x in all_markets
+                if x['uuid'] not in removed and 'scenario' in x}
+        res = [x['scenario']['uuid'] for x in markets
+               if 'scenario' in x and x['scenario']['uuid'] not in used]
+
+        # scenarios without any market, i.e. from failed market creation
+        if self.orphans:
+            referenced = used | set(res)
+
+            for x in self._vmt.get_scenarios(fetch_all=True):
+                if x['uuid'] not in referenced \
+                   and str(x.get('displayName', '')).startswith(self.prefixes):
+                    res.append(x['uuid'])
+
+        return list(dict.fromkeys(res))
+
+    def remove(self, markets=(), scenarios=()):
+        """Removes markets and scenarios concurrently.
+
+        Args:
+            markets (list, optional): Market DTOs or UUIDs to remove.
+            scenarios (list, optional): Scenario UUIDs to remove.
+
+        Returns:
+            :py:class:`CollectResult`: Removal results.
+
+        Raises:
+            InvalidMarketError: Attempting to remove a system market.
+        """
+        markets = [x if isinstance(x, dict) else {'uuid': x} for x in markets]
+
+        for x in markets:
+            if self.__is_system(x):
+                raise InvalidMarketError(f'Attempting to delete system market [{x["uuid"]}]')
+
+        limiter = _RateLimiter(self.rate)
+        local = threading.local()
+        res = CollectResult([], [], {})
+        lock = threading.Lock()
+
+        def delete(kind, uuid):
+            if not hasattr(local, 'conn'):
+                local.conn = copy.copy(self._vmt)
+
+            limiter.wait()
+
+            try:
+                if kind == 'markets':
+                    local.conn.del_market(uuid)
+                else:
+                    local.conn.del_scenario(uuid)
+            except Exception as e:                                             # pylint: disable=W0703
+                self.log(f'Unable to remove {kind[:-1]} [{uuid}]: {e}', level='warn')
+
+                with lock:
+                    res.errors[uuid] = e
+            else:
+                with lock:
+                    getattr(res, kind).append(uuid)
+
+        # markets are removed before the scenarios they reference
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as pool:
+            list(pool.map(lambda x: delete('markets', x['uuid']), markets))
+
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as pool:
+            list(pool.map(lambda x: delete('scenarios', x), scenarios))
+
+        return res
+
+    def collect(self, dry_run=False):
+        """Finds and removes eligible markets and scenarios.
+
+        Args:
+            dry_run (bool, optional): If ``True``, nothing is removed, and the
+                eligible objects are returned. (default: ``False``)
+
+        Returns:
+            :py:class:`CollectResult`: Removal results.
+
+        Raises:
+            ValueError: If no ``min_age`` is set, unless ``dry_run``.
+        """
+        if not dry_run and not self.min_age:
+            raise ValueError('min_age must be set to collect markets')
+
+        all_markets = self._vmt.get_markets(fetch_all=True)
+        markets = self.find_markets(all_markets)
+        scenarios = self.find_scenarios(markets, all_markets) if self.scenarios else []
+
+        self.log(f'Collecting {len(markets)} markets, {len(scenarios)} scenarios', level='debug')
+
+        if dry_run:
+            return CollectResult([x['uuid'] for x in markets], scenarios, {})
+
+        return self.remove(markets, scenarios)
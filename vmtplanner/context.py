@@ -0,0 +1,188 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+import copy
+import threading
+import weakref
+
+import vmtconnect as vc
+
+
+
+class PlanContext:
+    """Per connection plan context.
+
+    Caches connection level details required to construct plans: the current
+    user, version checks, the XL or Classic platform, and the cluster scope of
+    each market. Plans sharing a context may be created without any API
+    requests once the context is populated. Cached values persist until
+    explicitly invalidated.
+
+    A shared context is created for each connection on first use, see :meth:`get`.
+    Shallow copies of a connection made with :meth:`copy_connection` share the
+    context of the original. The context holds only weak references to its
+    connections, and is released along with them.
+
+    Args:
+        connection (:py:class:`~vmtconnect.Connection`): Connection the context
+            belongs to.
+
+    Example:
+        .. code-block:: python
+
+           ctx = PlanContext.get(vmt)
+
+           # new clusters were added
+           ctx.invalidate('clusters')
+    """
+    __contexts = weakref.WeakKeyDictionary()
+    __contexts_lock = threading.Lock()
+
+    def __init__(self, connection):
+        self.__refs = [weakref.ref(connection)]
+        self.__user = None
+        self.__versions = set()
+        self.__clusters = {}
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def get(cls, connection):
+        """Returns the shared context for a connection, creating it if needed.
+
+        Args:
+            connection (:py:class:`~vmtconnect.Connection`): Connection to get
+                the context of.
+
+        Returns:
+            :py:class:`PlanContext`: Shared connection context.
+        """
+        with cls.__contexts_lock:
+            ctx = cls.__contexts.get(connection)
+
+            if ctx is None:
+                ctx = cls.__contexts[connection] = cls(connection)
+
+            return ctx
+
+    @classmethod
+    def copy_connection(cls, connection):
+        """Returns a shallow copy of a connection, sharing its context.
+
+        :py:class:`~vmtconnect.Connection` keeps per-request state, and is not
+        safe to share between threads. Plans run concurrently are each given a
+        copy, which shares the cached context of the original connection.
+
+        Args:
+            connection (:py:class:`~vmtconnect.Connection`): Connection to copy.
+
+        Returns:
+            :py:class:`~vmtconnect.Connection`: Connection copy.
+        """
+        ctx = cls.get(connection)
+        conn = copy.copy(connection)
+
+        with cls.__contexts_lock:
+            cls.__contexts[conn] = ctx
+            ctx.__refs = [x for x in ctx.__refs if x() is not None]
+            ctx.__refs.append(weakref.ref(conn))
+
+        return conn
+
+    @property
+    def _vmt(self):
+        # any live connection sharing the context
+        for ref in self.__refs:
+            conn = ref()
+
+            if conn is not None:
+                return conn
+
+        raise ReferenceError('The connections of the plan context no longer exist')
+
+    @property
+    def user(self):
+        """Username of the connection user."""
+        if self.__user is None:
+            self.__user = self._vmt.get_users('me')[0]['username']
+
+        return self.__user
+
+    @property
+    def version(self):
+        """Connection :py:class:`~vmtconnect.Version`."""
+        return self._vmt.version
+
+    @property
+    def is_xl(self):
+        """``True`` if connected to an XL instance, ``False`` otherwise."""
+        return self._vmt.version.platform == 'xl'
+
+    def check_version(self, required, exclude=None):
+        """Checks the connection version, remembering passing checks.
+
+        Args:
+            required (list): Required version specifications.
+            exclude (list, optional): Excluded versions.
+
+        Raises:
+            :py:class:`~vmtconnect.VMTVersionError`: If the version is not
+            supported.
+        """
+        key = (tuple(required), tuple(exclude or []))
+
+        if key in self.__versions:
+            return
+
+        vc.VersionSpec(required, exclude=exclude).check(self._vmt.version)
+
+        with self.__lock:
+            self.__versions.add(key)
+
+    def clusters(self, market='Market'):
+        """Returns the cluster UUIDs of a market.
+
+        Args:
+            market (str, optional): Market UUID. (default: ``Market``)
+
+        Returns:
+            list: Cluster UUIDs.
+        """
+        with self.__lock:
+            res = self.__clusters.get(market)
+
+        if res is None:
+            res = [x['uuid'] for x in self._vmt.search(types=['Cluster'], scopes=[market])]
+
+            with self.__lock:
+                self.__clusters[market] = res
+
+        return list(res)
+
+    def invalidate(self, *names):
+        """Clears cached values.
+
+        Args:
+            *names (str): Values to clear, any of ``user``, ``version``, and
+                ``clusters``. If none are given, all values are cleared.
+        """
+        names = names or ('user', 'version', 'clusters')
+
+        with self.__lock:
+            if 'user' in names:
+                self.__user = None
+            if 'version' in names:
+                self.__versions = set()
+            if 'clusters' in names:
+                self.__clusters = {}
@@ -0,0 +1,124 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+import json
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+
+class JSONBackend:
+    """Standard library JSON encoder backend.
+
+    Encodes scenario DTOs in the compact wire format: sorted keys, no
+    indentation, and minimal separators. Alternate backends subclass this class,
+    overriding :meth:`encode`, and are installed with :func:`register_backend`.
+
+    Attributes:
+        name (str): Backend name.
+    """
+    name = 'json'
+
+    def encode(self, obj):
+        """Returns the compact JSON encoding of an object.
+
+        Args:
+            obj: Object to encode.
+
+        Returns:
+            bytes: UTF-8 encoded JSON.
+        """
+        return json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()
+
+
+class OrjsonBackend(JSONBackend):
+    """`orjson <https://github.com/ijl/orjson>`_ JSON encoder backend.
+
+    Available only if the ``orjson`` package is installed. Objects orjson is
+    unable to encode, such as integers larger than 64 bits, are encoded by the
+    standard library instead.
+    """
+    name = 'orjson'
+
+    def encode(self, obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            return super().encode(obj)
+
+
+_lock = threading.Lock()
+_backends = {JSONBackend.name: JSONBackend()}
+
+if orjson is not None:
+    _backends[OrjsonBackend.name] = OrjsonBackend()
+
+_backend = _backends.get(OrjsonBackend.name, _backends[JSONBackend.name])
+
+
+
+def available_backends():
+    """Returns the names of the registered backends."""
+    with _lock:
+        return list(_backends)
+
+
+def get_backend():
+    """Returns the current backend.
+
+    The fastest installed backend is used by default, with the standard
+    library as the fallback.
+
+    Returns:
+        :py:class:`JSONBackend`: Current backend.
+    """
+    return _backend
+
+
+def register_backend(backend, default=False):
+    """Registers a backend.
+
+    Args:
+        backend (:py:class:`JSONBackend`): Backend instance, replacing any
+            registered backend of the same name.
+        default (bool, optional): If ``True``, the backend becomes the current
+            backend. (default: ``False``)
+    """
+    global _backend                                                            # pylint: disable=W0603
+
+    with _lock:
+        _backends[backend.name] = backend
+
+        if default or _backend.name == backend.name:
+            _backend = backend
+
+
+def set_backend(name):
+    """Sets the current backend.
+
+    Args:
+        name (str): Registered backend name.
+
+    Raises:
+        KeyError: If no backend of the name is registered.
+    """
+    global _backend                                                            # pylint: disable=W0603
+
+    with _lock:
+        _backend = _backends[name]
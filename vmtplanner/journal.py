@@ -0,0 +1,305 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+from collections import namedtuple
+import datetime
+import json
+import sqlite3
+import threading
+
+import umsg.mixins
+
+from vmtplanner import _SYSTEM_MARKETS, Plan
+
+
+
+JournalEntry = namedtuple('JournalEntry', [
+    'run_id',
+    'plan_class',
+    'host',
+    'fingerprint',
+    'scenario_id',
+    'market_id',
+    'market_name',
+    'state',
+    'status',
+    'attempts',
+    'errors',
+    'metrics',
+    'started',
+    'updated'
+])
+JournalEntry.__doc__ = """Plan run journal entry.
+
+Attributes:
+    run_id (str): Unique run identifier.
+    plan_class (str): Plan class name.
+    host (str): Instance host name.
+    fingerprint (str): :meth:`~vmtplanner.PlanSpec.fingerprint` of the plan spec.
+    scenario_id (str): Scenario UUID, or ``None``.
+    market_id (str): Market UUID, or ``None``.
+    market_name (str): Market name, or ``None``.
+    state (str): Last known :py:class:`~vmtplanner.MarketState` name, or ``None``.
+    status (str): Run status, one of ``running``, ``complete``, ``failed``, or
+        ``abandoned``.
+    attempts (int): Number of run attempts.
+    errors (list): Error messages of failed attempts, and the final error.
+    metrics (dict): :meth:`~vmtplanner.metrics.PlanMetrics.to_dict` phase timings.
+    started (str): ISO 8601 run start time.
+    updated (str): ISO 8601 time of the last update.
+"""
+
+
+class PlanJournal(umsg.mixins.LoggingMixin):
+    """SQLite plan run journal.
+
+    Records every run of the plans it is assigned to, updating the entry as the
+    run progresses: scenario and market creation, each market state change,
+    failed attempts, and the final result with phase timings. Unfinished runs
+    left by a crashed process may be resumed with :meth:`resume`, or removed
+    with :meth:`cleanup`.
+
+    A plan uses the journal when assigned to its :py:attr:`~vmtplanner.Plan.journal`
+    attribute. A journal may be shared by any number of plans and threads.
+
+    Args:
+        path (str): SQLite database file path, created if it does not exist.
+
+    Note:
+        Requires SQLite 3.24 or later, see :py:data:`sqlite3.sqlite_version`.
+
+    Example:
+        .. code-block:: python
+
+           journal = PlanJournal('/var/lib/planner/journal.db')
+
+           # after a restart
+           for entry in journal.unfinished():
+               if entry.market_id:
+                   journal.resume(vmt, entry).resume()
+               else:
+                   journal.cleanup(vmt, entry)
+    """
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETE = 'complete'
+    STATUS_FAILED = 'failed'
+    STATUS_ABANDONED = 'abandoned'
+
+    __schema = """
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY,
+            plan_class TEXT,
+            host TEXT,
+            fingerprint TEXT,
+            scenario_id TEXT,
+            market_id TEXT,
+            market_name TEXT,
+            state TEXT,
+            status TEXT,
+            attempts INTEGER,
+            errors TEXT,
+            metrics TEXT,
+            started TEXT,
+            updated TEXT
+        );
+        CREATE INDEX IF NOT EXISTS runs_status ON runs (status);
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__last = {}
+        self.__fingerprints = {}
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+
+        with self.__lock, self.__db:
+            self.__db.execute('PRAGMA journal_mode=WAL')
+            self.__db.executescript(self.__schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def __entry(row):
+        row = list(row)
+        row[10] = json.loads(row[10]) if row[10] else []
+        row[11] = json.loads(row[11]) if row[11] else None
+
+        return JournalEntry(*row)
+
+    def __query(self, sql, args=()):
+        with self.__lock:
+            return [self.__entry(x) for x in self.__db.execute(sql, args)]
+
+    def record(self, plan, status=STATUS_RUNNING, error=None):
+        """Records the current state of a plan run.
+
+        The entry is only written if the run has changed since it was last
+        recorded.
+
+        Args:
+            plan (:py:class:`~vmtplanner.Plan`): Plan being run.
+            status (str, optional): Run status. (default: ``running``)
+            error (Exception, optional): Final run error.
+        """
+        metrics = plan.metrics
+        attempts = metrics.attempts if metrics else []
+        errors = [x.error for x in attempts if x.error]
+        state = plan.snapshot.state.name if plan.snapshot and plan.snapshot.state else None
+
+        if error is not None:
+            errors.append(str(error))
+
+        key = (plan.scenario_id, plan.market_id, state, status, len(attempts), len(errors))
+
+        with self.__lock:
+            if self.__last.get(plan.run_id) == key:
+                return
+
+            fingerprint = self.__fingerprints.get(plan.run_id) or plan.spec.fingerprint()
+
+            if status == self.STATUS_RUNNING:
+                self.__last[plan.run_id] = key
+                self.__fingerprints[plan.run_id] = fingerprint
+            else:
+                self.__last.pop(plan.run_id, None)
+                self.__fingerprints.pop(plan.run_id, None)
+
+            now = datetime.datetime.now().isoformat()
+            started = metrics.start.isoformat() if metrics else now
+            timings = json.dumps(metrics.to_dict()) if metrics and status != self.STATUS_RUNNING else None
+
+            with self.__db:
+                self.__db.execute("""
+                    INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (run_id) DO UPDATE SET
+                        scenario_id = excluded.scenario_id,
+                        market_id = excluded.market_id,
+                        market_name = excluded.market_name,
+                        state = excluded.state,
+                        status = excluded.status,
+                        attempts = excluded.attempts,
+                        errors = excluded.errors,
+                        metrics = COALESCE(excluded.metrics, runs.metrics),
+                        updated = excluded.updated
+                    """, (plan.run_id, type(plan).__name__, getattr(plan._vmt, 'host', None),
+                          fingerprint, plan.scenario_id, plan.market_id,
+                          plan.market_name if plan.market_id else None, state, status,
+                          len(attempts), json.dumps(errors), timings, started, now))
+
+    def get(self, run_id):
+        """Returns the entry of a run, or ``None`` if not found."""
+        res = self.__query('SELECT * FROM runs WHERE run_id = ?', (run_id,))
+
+        return res[0] if res else None
+
+    def entries(self, status=None):
+        """Returns journal entries.
+
+        Args:
+            status (str, optional): Status to filter by. If ``None``, all
+                entries are returned.
+
+        Returns:
+            list: :py:class:`JournalEntry` objects, oldest first.
+        """
+        if status is None:
+            return self.__query('SELECT * FROM runs ORDER BY started')
+
+        return self.__query('SELECT * FROM runs WHERE status = ? ORDER BY started', (status,))
+
+    def unfinished(self):
+        """Returns the entries of runs which did not finish, i.e. interrupted by
+        a process exit.
+
+        Returns:
+            list: :py:class:`JournalEntry` objects, oldest first.
+        """
+        return self.entries(self.STATUS_RUNNING)
+
+    def set_status(self, run_id, status):
+        """Updates the status of a run.
+
+        Args:
+            run_id (str): Run identifier.
+            status (str): New status.
+        """
+        with self.__lock, self.__db:
+            self.__db.execute('UPDATE runs SET status = ?, updated = ? WHERE run_id = ?',
+                              (status, datetime.datetime.now().isoformat(), run_id))
+
+    def resume(self, connection, entry, plan_class=None, **kwargs):
+        """Returns a plan attached to the market of an unfinished run.
+
+        The returned plan continues the journal entry when completed with
+        :meth:`~vmtplanner.Plan.resume`.
+
+        Args:
+            connection (:py:class:`~vmtconnect.Connection`): Connection to the
+                instance the run was made on.
+            entry (:py:class:`JournalEntry`): Run to resume.
+            plan_class (class, optional): Plan class to use. (default:
+                :py:class:`~vmtplanner.Plan`)
+            **kwargs: Additional :meth:`~vmtplanner.Plan.from_market` arguments.
+
+        Returns:
+            :py:class:`~vmtplanner.Plan`: Attached plan.
+
+        Raises:
+            ValueError: If the run has no market.
+        """
+        if not entry.market_id:
+            raise ValueError(f'Run [{entry.run_id}] has no market to resume')
+
+        plan = (plan_class or Plan).from_market(connection, entry.market_id, **kwargs)
+        plan._run_id = entry.run_id
+        plan.journal = self
+
+        return plan
+
+    def cleanup(self, connection, entry, scenario=True):
+        """Removes the market, and scenario, of an unfinished run, and marks it
+        abandoned.
+
+        Args:
+            connection (:py:class:`~vmtconnect.Connection`): Connection to the
+                instance the run was made on.
+            entry (:py:class:`JournalEntry`): Run to remove.
+            scenario (bool, optional): If ``True``, removes the scenario as well.
+                (default: ``True``)
+        """
+        if entry.market_id and entry.market_id not in _SYSTEM_MARKETS \
+           and entry.market_name not in _SYSTEM_MARKETS:
+            try:
+                connection.del_market(entry.market_id)
+            except Exception as e:                                             # pylint: disable=W0703
+                self.log(f'Unable to remove market [{entry.market_id}]: {e}', level='warn')
+
+        if scenario and entry.scenario_id:
+            try:
+                connection.del_scenario(entry.scenario_id)
+            except Exception as e:                                             # pylint: disable=W0703
+                self.log(f'Unable to remove scenario [{entry.scenario_id}]: {e}', level='warn')
+
+        self.set_status(entry.run_id, self.STATUS_ABANDONED)
+
+    def close(self):
+        """Closes the journal database."""
+        with self.__lock:
+            self.__db.close()
@@ -0,0 +1,282 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+from collections import namedtuple
+from contextlib import contextmanager
+import contextvars
+import datetime
+from functools import wraps
+import threading
+import time
+
+
+
+# metrics of the plan phase executing in the current context
+_active = contextvars.ContextVar('vmtplanner_metrics', default=None)
+
+
+PhaseTiming = namedtuple('PhaseTiming', [
+    'name',
+    'attempt',
+    'start',
+    'duration',
+    'requests'
+])
+PhaseTiming.__doc__ = """Plan phase timing.
+
+Attributes:
+    name (str): Phase name.
+    attempt (int): Run attempt the phase belongs to, starting at 1, or ``None``
+        for phases outside of the retry loop.
+    start (:py:class:`~datetime.datetime`): Phase start time.
+    duration (float): Phase duration in seconds.
+    requests (int): Number of HTTP requests made during the phase.
+"""
+
+
+PlanAttempt = namedtuple('PlanAttempt', [
+    'attempt',
+    'start',
+    'duration',
+    'requests',
+    'error'
+])
+PlanAttempt.__doc__ = """Plan run attempt.
+
+Attributes:
+    attempt (int): Attempt number, starting at 1.
+    start (:py:class:`~datetime.datetime`): Attempt start time.
+    duration (float): Attempt duration in seconds.
+    requests (int): Number of HTTP requests made during the attempt.
+    error (str): Error which ended the attempt, or ``None`` on success.
+"""
+
+
+class _Phase:
+    __slots__ = ['name', 'attempt', 'start', 'mono', 'requests']
+
+    def __init__(self, name, attempt):
+        self.name = name
+        self.attempt = attempt
+        self.start = datetime.datetime.now()
+        self.mono = time.monotonic()
+        self.requests = 0
+
+
+class PlanMetrics:
+    """Plan run timing record.
+
+    Records the duration and number of HTTP requests of each phase of a plan
+    run. Phases run in the following order, with the attempt phases repeated
+    for each retry:
+
+    * ``pre_hook``: Pre-processing hook.
+    * ``scenario``: Scenario creation.
+    * ``market``: Plan market creation.
+    * ``queued``: Waiting for the server to start the plan.
+    * ``running``: Waiting for the server to complete the plan.
+    * ``sync``: Collection of the completed market details.
+    * ``post_hook``: Post-processing hook.
+
+    Attributes:
+        attempts (list): :py:class:`PlanAttempt` records.
+        duration (float): Total run duration in seconds.
+        phases (list): :py:class:`PhaseTiming` records, in order.
+        requests (int): Total number of HTTP requests.
+        server_duration (float): Server side plan duration in seconds, or
+            ``None`` if unavailable.
+        start (:py:class:`~datetime.datetime`): Run start time.
+
+    Note:
+        Requests are counted for the thread, or asyncio task, running the plan.
+        Status polls made by a shared :py:class:`~vmtplanner.pool.PlanPoller`
+        are not counted, though the ``queued`` and ``running`` phases are still
+        timed from the polled states.
+    """
+    def __init__(self):
+        self.start = datetime.datetime.now()
+        self.phases = []
+        self.attempts = []
+        self.server_duration = None
+        self.__mono = time.monotonic()
+        self.__duration = None
+        self.__phase = None
+        self.__attempt = None
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        return f'PlanMetrics(duration={self.duration:.1f}, requests={self.requests}, attempts={len(self.attempts)})'
+
+    @property
+    def duration(self):
+        if self.__duration is not None:
+            return self.__duration
+
+        return time.monotonic() - self.__mono
+
+    @property
+    def requests(self):
+        with self.__lock:
+            current = self.__phase.requests if self.__phase else 0
+
+        return sum(x.requests for x in self.phases) + current
+
+    def __close_phase(self):
+        p, self.__phase = self.__phase, None
+
+        if p is not None:
+            self.phases.append(PhaseTiming(p.name, p.attempt, p.start,
+                                           time.monotonic() - p.mono, p.requests))
+
+    def _count(self):
+        with self.__lock:
+            if self.__phase is not None:
+                self.__phase.requests += 1
+
+    def enter(self, name):
+        """Ends the current phase, and starts the named phase.
+
+        Args:
+            name (str): Phase name.
+        """
+        with self.__lock:
+            self.__close_phase()
+            attempt = self.__attempt.attempt if self.__attempt else None
+            self.__phase = _Phase(name, attempt)
+
+    def leave(self):
+        """Ends the current phase."""
+        with self.__lock:
+            self.__close_phase()
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager timing the enclosed block as the named phase.
+
+        Args:
+            name (str): Phase name.
+        """
+        self.enter(name)
+
+        try:
+            yield self
+        finally:
+            self.leave()
+
+    def mark_running(self):
+        """Moves from the ``queued`` phase to the ``running`` phase, once the
+        server has started the plan."""
+        with self.__lock:
+            if self.__phase is None or self.__phase.name != 'queued':
+                return
+
+        self.enter('running')
+
+    def begin_attempt(self):
+        """Starts a new run attempt."""
+        with self.__lock:
+            self.__close_phase()
+            self.__attempt = _Phase('attempt', len(self.attempts) + 1)
+
+    def end_attempt(self, error=None):
+        """Ends the current run attempt.
+
+        Args:
+            error (Exception, optional): Error which ended the attempt.
+        """
+        with self.__lock:
+            self.__close_phase()
+            a, self.__attempt = self.__attempt, None
+
+            if a is None:
+                return
+
+            requests = sum(x.requests for x in self.phases if x.attempt == a.attempt)
+            self.attempts.append(PlanAttempt(a.attempt, a.start, time.monotonic() - a.mono,
+                                             requests, str(error) if error else None))
+
+    def close(self):
+        """Ends the record, closing any open phase or attempt."""
+        if self.__attempt is not None:
+            self.end_attempt()
+
+        with self.__lock:
+            self.__close_phase()
+            self.__duration = time.monotonic() - self.__mono
+
+    def totals(self):
+        """Returns the duration and request totals of each phase.
+
+        Returns:
+            dict: Phase name keyed ``(duration, requests)`` tuples, summed over
+            all attempts.
+        """
+        res = {}
+
+        for x in self.phases:
+            d, r = res.get(x.name, (0, 0))
+            res[x.name] = (d + x.duration, r + x.requests)
+
+        return res
+
+    def to_dict(self):
+        """Returns the record as a JSON serializable dictionary."""
+        return {
+            'start': self.start.isoformat(),
+            'duration': self.duration,
+            'server_duration': self.server_duration,
+            'requests': self.requests,
+            'phases': [dict(x._asdict(), start=x.start.isoformat()) for x in self.phases],
+            'attempts': [dict(x._asdict(), start=x.start.isoformat()) for x in self.attempts]
+        }
+
+    @contextmanager
+    def activate(self):
+        """Context manager directing request counts from the current thread, or
+        asyncio task, to this record."""
+        token = _active.set(self)
+
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+
+
+def instrument(connection):
+    """Enables request counting on a connection.
+
+    The connection's internal request method is wrapped in place, once. Requests
+    are counted towards the :py:class:`PlanMetrics` active in the calling
+    context, and pass through untouched otherwise.
+
+    Args:
+        connection (:py:class:`~vmtconnect.Connection`): Connection to instrument.
+    """
+    func = getattr(connection, '_request', None)
+
+    if func is None or getattr(func, '_vmtplanner_counted', False):
+        return
+
+    @wraps(func)
+    def _request(*args, **kwargs):
+        metrics = _active.get()
+
+        if metrics is not None:
+            metrics._count()
+
+        return func(*args, **kwargs)
+
+    _request._vmtplanner_counted = True
+    connection._request = _request
@@ -13,7 +13,7 @@
 # limitations under the License.
 # libraries
 
-from vmtplanner import AutomationSetting, Plan, PlanSpec, PlanType
+from vmtplanner import AutomationSetting, Plan, PlanContext, PlanSpec, PlanType
 
 
 
@@ -28,6 +28,7 @@ class BaseBalancePlan(Plan):
             (default: ``Market``)
         scope (list, optional): Scope of the plan market. If ``None``, then a
             list of all clusters in the given market will be used.
+        **kwargs: Additional :py:class:`~vmtplanner.Plan` arguments.
 
     """
     def __init__(self, connection, spec=None, market='Market', scope=None, **kwargs):
@@ -35,6 +36,7 @@ class BaseBalancePlan(Plan):
         # _before_ we call the parent class
         self._vmt = connection
         self.base_market = market
+        self.context = kwargs.get('context') or PlanContext.get(connection)
 
         if spec is None and market == 'Market':
             spec = self.__std_spec(scope)
@@ -53,8 +55,7 @@ class BaseBalancePlan(Plan):
         ]
 
         if scope is None:
-            res = self._vmt.search(types=['Cluster'], scopes=[self.base_market])
-            scope = [x['uuid'] for x in res]
+            scope = self.context.clusters(self.base_market)
 
         spec = PlanSpec(type=PlanType.OPTIMIZE_ONPREM, scope=scope)
 
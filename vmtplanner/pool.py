@@ -0,0 +1,386 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+from collections import namedtuple
+from concurrent.futures import (ALL_COMPLETED, FIRST_COMPLETED, Future,
+                                ThreadPoolExecutor, as_completed, wait)
+import threading
+import time
+
+import umsg.mixins
+
+from vmtplanner import (InvalidMarketError, MarketSnapshot, Plan, PlanContext,
+                        PlanError)
+
+
+
+PlanResult = namedtuple('PlanResult', [
+    'plan',
+    'state',
+    'result',
+    'script_duration',
+    'server_duration',
+    'error'
+])
+PlanResult.__doc__ = """Plan pool result.
+
+Attributes:
+    plan (:py:class:`~vmtplanner.Plan`): Plan instance, or ``None`` if the plan
+        could not be created.
+    state (:py:class:`~vmtplanner.MarketState`): Final market state, or ``None``.
+    result: Plan :meth:`~vmtplanner.Plan.run` return value, including any post
+        processing hook results.
+    script_duration (int): Plan script duration in seconds.
+    server_duration (int): Plan server side duration in seconds.
+    error (Exception): Exception raised by the plan, or ``None`` on success.
+"""
+
+
+class _Watch:
+    __slots__ = ['plan', 'future', 'callbacks', 'state', 'passes']
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.future = Future()
+        self.callbacks = []
+        self.state = None
+        self.passes = 0
+
+
+class PlanPoller(umsg.mixins.LoggingMixin):
+    """Shared plan status poller.
+
+    Watches any number of in-flight plans using a single market listing request
+    per polling pass, in place of each plan requesting its own market. State
+    changes are pushed to each watched plan's :py:attr:`~vmtplanner.Plan.snapshot`,
+    and reported to any registered callbacks.
+
+    A plan uses the poller while running when assigned to its
+    :py:attr:`~vmtplanner.Plan.poller` attribute, or when run through a
+    :py:class:`PlanPool` with a poller.
+
+    Args:
+        connection (:py:class:`~vmtconnect.Connection`): Connection to list
+            markets with. The poller uses its own shallow copy, as it polls
+            from a separate thread. All watched plans must belong to the same
+            instance.
+        interval (float, optional): Seconds between polling passes. (default: ``10``)
+        max_errors (int, optional): Consecutive polling failures allowed before
+            the error is raised to all watchers. (default: ``3``)
+
+    Example:
+        .. code-block:: python
+
+           poller = PlanPoller(vmt, interval=15)
+
+           with PlanPool(max_markets=50, poller=poller) as pool:
+               results = list(pool.run([(vmt, x) for x in specs]))
+    """
+    def __init__(self, connection, interval=10, max_errors=3):
+        super().__init__()
+        self._vmt = PlanContext.copy_connection(connection)
+        self.interval = interval
+        self.max_errors = max_errors
+        self.__watches = {}
+        self.__errors = 0
+        self.__cond = threading.Condition()
+        self.__thread = None
+
+    def __loop(self):
+        while True:
+            with self.__cond:
+                if not self.__watches:
+                    self.__thread = None
+                    return
+
+            self.poll()
+
+            with self.__cond:
+                self.__cond.wait(self.interval)
+
+    def __finish(self, watch, result=None, error=None):
+        with self.__cond:
+            # already removed by unwatch()
+            if self.__watches.pop(watch.plan.market_id, None) is None:
+                return
+
+        if error is not None:
+            watch.future.set_exception(error)
+        else:
+            watch.future.set_result(result)
+
+    def watch(self, plan, callback=None):
+        """Adds a running plan to the poller.
+
+        Args:
+            plan (:py:class:`~vmtplanner.Plan`): Plan to watch, the plan market
+                must already exist.
+            callback (callable, optional): Called with the plan and the new
+                :py:class:`~vmtplanner.MarketSnapshot` each time the market state
+                changes.
+
+        Returns:
+            :py:class:`~concurrent.futures.Future`: Resolves to the final
+            :py:class:`~vmtplanner.MarketSnapshot` once the plan finishes.
+        """
+        if plan.market_id is None:
+            raise InvalidMarketError('Market does not exist')
+
+        with self.__cond:
+            watch = self.__watches.get(plan.market_id)
+
+            if watch is None:
+                watch = self.__watches[plan.market_id] = _Watch(plan)
+
+            if callback is not None:
+                watch.callbacks.append(callback)
+
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__loop, daemon=True)
+                self.__thread.start()
+
+        return watch.future
+
+    def unwatch(self, plan):
+        """Removes a plan from the poller. Pending results are cancelled."""
+        with self.__cond:
+            watch = self.__watches.pop(plan.market_id, None)
+
+        if watch is not None:
+            watch.future.cancel()
+
+    def poll(self):
+        """Performs a single polling pass for all watched plans."""
+        with self.__cond:
+            watches = list(self.__watches.values())
+
+        if not watches:
+            return
+
+        try:
+            markets = {x['uuid']: x for x in self._vmt.get_markets(fetch_all=True)}
+            self.__errors = 0
+        except Exception as e:                                                 # pylint: disable=W0703
+            self.__errors += 1
+            self.log(f'Market status poll failed ({self.__errors}/{self.max_errors}): {e}', level='warn')
+
+            if self.__errors >= self.max_errors:
+                for w in watches:
+                    self.__finish(w, error=e)
+
+            return
+
+        now = time.monotonic()
+
+        for w in watches:
+            if w.plan.market_id not in markets:
+                self.__finish(w, error=InvalidMarketError(f'Market [{w.plan.market_id}] no longer exists'))
+                continue
+
+            snapshot = MarketSnapshot(markets[w.plan.market_id], now)
+            w.plan._set_snapshot(snapshot)
+
+            if snapshot.state != w.state:
+                w.state = snapshot.state
+
+                for cb in w.callbacks:
+                    try:
+                        cb(w.plan, snapshot)
+                    except Exception as e:                                     # pylint: disable=W0703
+                        self.log(f'Poller callback error: {e}', level='warn')
+
+            try:
+                if w.plan._check_progress(snapshot.state, w.passes):
+                    self.__finish(w, result=snapshot)
+            except PlanError as e:
+                self.__finish(w, error=e)
+
+            w.passes += 1
+
+    def wait_any(self, plans, timeout=None):
+        """Waits for the first of the given plans to finish.
+
+        Args:
+            plans (list): Running :py:class:`~vmtplanner.Plan` objects.
+            timeout (float, optional): Maximum seconds to wait.
+
+        Returns:
+            tuple: Lists of finished and pending plans.
+        """
+        return self.__wait(plans, timeout, FIRST_COMPLETED)
+
+    def wait_all(self, plans, timeout=None):
+        """Waits for all of the given plans to finish.
+
+        Args:
+            plans (list): Running :py:class:`~vmtplanner.Plan` objects.
+            timeout (float, optional): Maximum seconds to wait.
+
+        Returns:
+            tuple: Lists of finished and pending plans.
+        """
+        return self.__wait(plans, timeout)
+
+    def __wait(self, plans, timeout, return_when=ALL_COMPLETED):
+        futures = {self.watch(x): x for x in plans}
+        done, pending = wait(futures, timeout=timeout, return_when=return_when)
+
+        return [futures[x] for x in done], [futures[x] for x in pending]
+
+
+class PlanPool(umsg.mixins.LoggingMixin):
+    """Bounded concurrency plan runner.
+
+    Runs many plans at once, while limiting the number of plan markets active
+    on the server at any given time. Each worker runs one plan to completion,
+    including hooks and retries, before starting the next.
+
+    Args:
+        max_markets (int, optional): Maximum number of plan markets running
+            concurrently. (default: ``4``)
+        plan_class (class, optional): :py:class:`~vmtplanner.Plan` class used to
+            construct plans from ``(connection, spec)`` pairs. Each plan is given
+            its own shallow copy of the connection. (default:
+            :py:class:`~vmtplanner.Plan`)
+        cleanup (bool, optional): If ``True``, each plan market and scenario is
+            removed once the plan finishes. (default: ``False``)
+        poller (:py:class:`PlanPoller`, optional): Shared status poller for
+            all plans in the pool. If ``None``, plans poll individually.
+
+    Example:
+        .. code-block:: python
+
+           # each plan runs on its own copy of vmt
+           with PlanPool(max_markets=8) as pool:
+               for res in pool.run([(vmt, x) for x in specs]):
+                   print(res.plan.market_name, res.state, res.error)
+
+    Note:
+        :py:class:`~vmtconnect.Connection` keeps per-request state, and is not
+        safe to share between threads. Pre-built plans must each have their own
+        connection, see :meth:`~vmtplanner.context.PlanContext.copy_connection`.
+    """
+    def __init__(self, max_markets=4, plan_class=Plan, cleanup=False, poller=None):
+        super().__init__()
+
+        if max_markets < 1:
+            raise ValueError('max_markets must be 1 or greater')
+
+        self.max_markets = max_markets
+        self.plan_class = plan_class
+        self.cleanup = cleanup
+        self.poller = poller
+        self.__executor = ThreadPoolExecutor(max_workers=max_markets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def __run(self, connection, spec, plan, kwargs):
+        result = error = None
+
+        try:
+            if plan is None:
+                plan = self.plan_class(PlanContext.copy_connection(connection), spec, **kwargs)
+
+            if self.poller is not None:
+                plan.poller = self.poller
+
+            result = plan.run()
+        except Exception as e:                                                 # pylint: disable=W0703
+            self.log(f'Plan [{getattr(plan, "market_name", None)}] failed: {e}', level='debug')
+            error = e
+
+        if plan is None:
+            return PlanResult(None, None, None, None, None, error)
+
+        if self.cleanup and plan.initialized:
+            try:
+                plan.delete()
+            except Exception as e:                                             # pylint: disable=W0703
+                self.log(f'Unable to remove plan market [{plan.market_id}]: {e}', level='warn')
+
+        return PlanResult(plan, plan.result, result, plan.script_duration,
+                          plan.server_duration, error)
+
+    def submit(self, connection=None, spec=None, plan=None, **kwargs):
+        """Queues a plan to be run.
+
+        Args:
+            connection (:py:class:`~vmtconnect.Connection`, optional): Connection
+                to run the plan with, the plan is given a shallow copy.
+            spec (:py:class:`~vmtplanner.PlanSpec`, optional): Plan specification.
+            plan (:py:class:`~vmtplanner.Plan`, optional): Pre-built plan to run
+                instead of a ``connection`` and ``spec`` pair.
+            **kwargs: Additional plan class arguments.
+
+        Returns:
+            :py:class:`~concurrent.futures.Future`: Resolves to a :py:class:`PlanResult`.
+            Plan errors are reported in the result, not raised.
+        """
+        return self.__executor.submit(self.__run, connection, spec, plan, kwargs)
+
+    def run(self, plans):
+        """Runs a batch of plans.
+
+        Args:
+            plans (iterable): :py:class:`~vmtplanner.Plan` objects, or
+                ``(connection, spec)`` pairs.
+
+        Yields:
+            :py:class:`PlanResult`: Plan results in completion order.
+        """
+        futures = []
+
+        for x in plans:
+            if isinstance(x, Plan):
+                futures.append(self.submit(plan=x))
+            else:
+                futures.append(self.submit(*x))
+
+        for f in as_completed(futures):
+            yield f.result()
+
+    def shutdown(self, wait=True):
+        """Stops accepting plans, and releases the workers.
+
+        Args:
+            wait (bool, optional): If ``True``, waits for queued plans to finish.
+                (default: ``True``)
+        """
+        self.__executor.shutdown(wait=wait)
+
+
+
+def run_many(plans, max_markets=4, **kwargs):
+    """Runs a batch of plans with bounded concurrency.
+
+    Convenience wrapper for :meth:`PlanPool.run`.
+
+    Args:
+        plans (iterable): :py:class:`~vmtplanner.Plan` objects, each with its
+            own connection, or ``(connection, spec)`` pairs, which may share a
+            connection.
+        max_markets (int, optional): Maximum number of plan markets running
+            concurrently. (default: ``4``)
+        **kwargs: Additional :py:class:`PlanPool` arguments.
+
+    Returns:
+        list: :py:class:`PlanResult` objects in completion order.
+    """
+    with PlanPool(max_markets, **kwargs) as pool:
+        return list(pool.run(plans))
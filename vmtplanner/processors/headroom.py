@@ -23,10 +23,12 @@ import json
 from pprint import pprint
 from statistics import mean
 import time
+from uuid import uuid4
 
 import umsg.mixins
 
 import vmtplanner
+import vmtplanner.aio
 import vmtplanner.plans
 
 try:
@@ -622,6 +624,7 @@ class ClusterHeadroom(vmtplanner.plans.BaseBalancePlan):
         templates (list): List of :py:class`Template` objects.
         growth_lookback (int): Number of days to use for growth calcuation.
         mode (:py:class:`HeadroomMode`, optional): Headroom calculation mode.
+        **kwargs: Additional :py:class:`~vmtplanner.Plan` arguments.
 
     Attributes:
         commodities (list): Commodities to calculate for headroom.
@@ -632,11 +635,22 @@ class ClusterHeadroom(vmtplanner.plans.BaseBalancePlan):
         templates (list): List of :py:class`Template` objects.
         tempalte_commodity (dict): Dictionary map of commodities to template
             attributes.
+
+    Note:
+        A headroom plan interrupted mid-run may be completed with
+        :meth:`~vmtplanner.Plan.from_market` and :meth:`~vmtplanner.Plan.resume`,
+        passing the groups and templates as keyword arguments. The headroom
+        post-processing is performed on the existing market.
+
+        When a :py:attr:`~vmtplanner.Plan.result_cache` is assigned, cached
+        clusters are reused by plans with the same groups, templates, growth
+        lookback, and mode.
     """
     def __init__(self, connection, spec=None, market='Market', scope=None,
                  groups=None, templates=None, growth_lookback=7,
-                 mode=HeadroomMode.SEPARATE):
-        super().__init__(connection, spec, market, name=f'Custom Headroom Plan {str(int(time.time()))}')
+                 mode=HeadroomMode.SEPARATE, **kwargs):
+        kwargs.setdefault('name', f'Custom Headroom Plan {str(int(time.time()))} {uuid4().hex[:8]}')
+        super().__init__(connection, spec, market, **kwargs)
         self.hook_post(self._post_cluster_headroom)
 
         self.__e_cache = None # entity cache, shared across clusters
@@ -645,6 +659,7 @@ class ClusterHeadroom(vmtplanner.plans.BaseBalancePlan):
         self.clusters = []
         self.groups = groups
         self.templates = templates
+        self.growth_lookback = growth_lookback
 
         self.growth_ts = int(time.mktime((datetime.datetime.now() + datetime.timedelta(days=-1*growth_lookback)).timetuple()) * 1000)
 
@@ -666,14 +681,17 @@ class ClusterHeadroom(vmtplanner.plans.BaseBalancePlan):
                 self.log(f'Error retrieving template information for [{x.name or x.uuid}]', level='warn')
 
     def _get_plan_scope(self):
+        # the completed market was already fetched by the final status poll
+        market = self.snapshot.market if self.snapshot else self.refresh().market
+
         try:
-            return self._vmt.get_markets(uuid=self.market_id)[0]['scenario']['scope']
+            return market['scenario']['scope']
         except KeyError:
             # Classic compatibility
             return self._vmt.get_scenarios(uuid=self.scenario_id)[0]['scope']
 
     def _update_members(self, cluster):
-        if self._vmt.is_xl():
+        if self.context.is_xl:
             self._update_members_xl(cluster)
         else:
             self._update_members_classic(cluster)
@@ -754,6 +772,16 @@ class ClusterHeadroom(vmtplanner.plans.BaseBalancePlan):
 
             processchain(type)
 
+    def _result_key(self):
+        groups = tuple((x.uuid, x.name) for x in self.groups or [])
+        templates = tuple((x.uuid, x.name, tuple(x.targets or []), tuple(x.clusters or []))
+                          for x in self.templates or [])
+
+        return (self.mode, self.growth_lookback, groups, templates)
+
+    def _restore_result(self, result):
+        self.clusters = list(result)
+
     def _post_cluster_headroom(self):
         # main processor
         if self.result != vmtplanner.MarketState.SUCCEEDED:
@@ -794,6 +822,22 @@ class ClusterHeadroom(vmtplanner.plans.BaseBalancePlan):
         return headroom
 
 
+class AsyncClusterHeadroom(vmtplanner.aio.AsyncPlan, ClusterHeadroom):
+    """asyncio cluster headroom plan
+
+    A :py:class:`ClusterHeadroom` plan driven by :py:class:`~vmtplanner.aio.AsyncPlan`.
+    The plan is run with ``await plan.run()``, and the headroom post-processing
+    is performed in the executor once the plan market completes.
+
+    Args:
+        connection (:py:class:`~vmtconnect.Connection`): :class:`~vmtconnect.Connection` or :class:`~vmtconnect.Session`.
+        executor (:py:class:`~concurrent.futures.Executor`, optional): Executor
+            used for API requests and post-processing.
+        **kwargs: :py:class:`ClusterHeadroom` arguments.
+    """
+    pass
+
+
 
 def condense_supplychain(chain, types=None):
     # flattens the separate supplychain types to a single dictionary of all
@@ -0,0 +1,120 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+import random
+import time
+
+from requests.exceptions import ConnectionError, Timeout
+import umsg.mixins
+import vmtconnect as vc
+
+
+
+class RetryPolicy(umsg.mixins.LoggingMixin):
+    """Plan retry policy.
+
+    Controls how a plan recovers from failures. Transient errors, such as
+    server errors and dropped connections, are retried within the stage that
+    raised them: scenario creation, market creation, or a status poll. Work
+    completed by earlier stages is reused. A plan market which fails to run
+    properly is removed, and the run is restarted from market creation using
+    the existing scenario.
+
+    Delays between tries grow exponentially from ``backoff`` up to
+    ``max_backoff`` seconds, randomized by ``jitter`` to avoid many plans
+    retrying in step.
+
+    Args:
+        max_retry (int, optional): Maximum number of plan run attempts.
+            (default: ``3``)
+        stage_retry (int, optional): Maximum number of tries for each stage
+            request. (default: ``3``)
+        backoff (float, optional): Initial retry delay in seconds. (default: ``1``)
+        max_backoff (float, optional): Maximum retry delay in seconds.
+            (default: ``60``)
+        jitter (float, optional): Random fraction applied to each delay.
+            (default: ``0.5``)
+        cleanup (bool, optional): If ``True``, markets abandoned by a failed
+            attempt are removed from the server. (default: ``True``)
+
+    Attributes:
+        transient (tuple): Exception classes retried within a stage.
+
+    Example:
+        .. code-block:: python
+
+           plan = vp.Plan(vmt, spec)
+           plan.retry_policy = RetryPolicy(max_retry=5, backoff=2)
+           plan.run()
+    """
+    transient = (vc.HTTP500Error, vc.VMTConnectionError, ConnectionError, Timeout)
+
+    def __init__(self, max_retry=3, stage_retry=3, backoff=1, max_backoff=60,
+                 jitter=0.5, cleanup=True):
+        super().__init__()
+        self.max_retry = max_retry
+        self.stage_retry = stage_retry
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.cleanup = cleanup
+
+    def is_transient(self, error):
+        """Returns ``True`` if the error may be retried within its stage."""
+        return isinstance(error, self.transient)
+
+    def delay(self, tries):
+        """Returns the seconds to wait before the next try.
+
+        Args:
+            tries (int): Number of failed tries so far, starting at 1.
+
+        Returns:
+            float: Seconds to wait.
+        """
+        wait = min(self.backoff * 2 ** (tries - 1), self.max_backoff)
+
+        return max(wait * (1 + random.uniform(-self.jitter, self.jitter)), 0)
+
+    def call(self, func, *args, stage=None, **kwargs):
+        """Calls a stage function, retrying transient errors.
+
+        Args:
+            func (callable): Stage function.
+            *args: Function arguments.
+            stage (str, optional): Stage name, for logging.
+            **kwargs: Function keyword arguments.
+
+        Returns:
+            The function return value.
+
+        Raises:
+            The last error, once :py:attr:`stage_retry` tries are exhausted, or
+            any non-transient error.
+        """
+        tries = 0
+
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except self.transient as e:
+                tries += 1
+
+                if tries >= self.stage_retry:
+                    raise
+
+                wait = self.delay(tries)
+                self.log(f'Retrying {stage or func.__name__} in {wait:.1f}s ({tries}/{self.stage_retry}): {e}', level='debug')
+                time.sleep(wait)
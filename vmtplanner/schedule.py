@@ -0,0 +1,183 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+import json
+import math
+import os
+import random
+from statistics import median, pstdev
+import threading
+
+import umsg.mixins
+
+from vmtplanner import MarketState
+
+
+
+class AdaptivePollSchedule(umsg.mixins.LoggingMixin):
+    """Adaptive plan status polling schedule.
+
+    Learns how long plans take to run on the server, and spaces status polls
+    accordingly: sparse early in a run, dense around the expected completion
+    time, and backing off gradually if the plan overruns. Durations are tracked
+    per plan type, scope size, and :meth:`~vmtplanner.PlanSpec.fingerprint`,
+    falling back to the plan type and scope size when a specific scenario has
+    no history.
+
+    A plan uses the schedule when assigned to its :py:attr:`~vmtplanner.Plan.poll_schedule`
+    attribute. Plans without history use the default dynamic polling interval.
+
+    Args:
+        path (str, optional): JSON file to persist durations to. If ``None``,
+            durations are kept in memory only.
+        history (int, optional): Number of durations retained per key.
+            (default: ``20``)
+        min_wait (float, optional): Minimum seconds between polls. (default: ``5``)
+        max_wait (float, optional): Maximum seconds between polls. (default: ``300``)
+        jitter (float, optional): Random fraction applied to each wait, to
+            avoid synchronized polling across plans. (default: ``0.1``)
+
+    Example:
+        .. code-block:: python
+
+           schedule = AdaptivePollSchedule('/var/lib/planner/durations.json')
+
+           plan = vp.Plan(vmt, spec)
+           plan.poll_schedule = schedule
+           plan.run()
+    """
+    def __init__(self, path=None, history=20, min_wait=5, max_wait=300, jitter=0.1):
+        super().__init__()
+        self.path = path
+        self.history = history
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.jitter = jitter
+        self.__durations = {}
+        self.__lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def __scope_bucket(spec):
+        # scopes of similar magnitude share a bucket
+        return int(math.log2(len(spec.scope) + 1))
+
+    def __plan_keys(self, plan):
+        # keyed by the current spec, which may change between runs; the spec
+        # caches its fingerprint until the settings change
+        spec = plan.spec
+        base = f'{spec.type.value}|{self.__scope_bucket(spec)}'
+
+        return (f'{base}|{spec.fingerprint()}', base)
+
+    def load(self):
+        """Loads durations from :py:attr:`path`."""
+        with open(self.path, 'r') as fp:
+            data = json.load(fp)
+
+        with self.__lock:
+            self.__durations = data
+
+    def save(self):
+        """Writes durations to :py:attr:`path`."""
+        if not self.path:
+            return
+
+        tmp = f'{self.path}.tmp'
+
+        with self.__lock:
+            with open(tmp, 'w') as fp:
+                json.dump(self.__durations, fp)
+
+            os.replace(tmp, self.path)
+
+    def expected(self, plan):
+        """Returns the expected server duration for the plan.
+
+        Args:
+            plan (:py:class:`~vmtplanner.Plan`): Plan to estimate.
+
+        Returns:
+            tuple: Expected duration and spread in seconds, or ``None`` if
+            there is no history.
+        """
+        keys = self.__plan_keys(plan)
+
+        with self.__lock:
+            for k in keys:
+                values = self.__durations.get(k)
+
+                if values:
+                    return median(values), pstdev(values)
+
+        return None
+
+    def next_wait(self, plan, elapsed):
+        """Returns the seconds to wait before the next status poll.
+
+        Args:
+            plan (:py:class:`~vmtplanner.Plan`): Running plan.
+            elapsed (float): Seconds since the server started running the
+                plan, excluding time spent queued, 0 if not yet running.
+
+        Returns:
+            float: Seconds to wait, or ``None`` if there is no history.
+        """
+        estimate = self.expected(plan)
+
+        if estimate is None:
+            return None
+
+        expected, spread = estimate
+        window = max(2 * self.min_wait, 0.1 * expected, spread)
+        remaining = expected - elapsed
+
+        if remaining > window:
+            # sparse early polling, converging on the expected end
+            wait = min(remaining / 2, remaining - window)
+        elif remaining > -window:
+            wait = self.min_wait
+        else:
+            # overrunning, back off in proportion to the overrun
+            wait = -remaining / 4
+
+        wait = min(max(wait, self.min_wait), self.max_wait)
+
+        return wait * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def record(self, plan):
+        """Records the server duration of a completed plan.
+
+        Args:
+            plan (:py:class:`~vmtplanner.Plan`): Completed plan.
+        """
+        if plan.snapshot is None or plan.snapshot.state != MarketState.SUCCEEDED \
+           or not plan.server_duration:
+            return
+
+        keys = self.__plan_keys(plan)
+
+        with self.__lock:
+            for k in keys:
+                values = self.__durations.setdefault(k, [])
+                values.append(plan.server_duration)
+                del values[:-self.history]
+
+        try:
+            self.save()
+        except OSError as e:
+            self.log(f'Unable to save plan durations to [{self.path}]: {e}', level='warn')
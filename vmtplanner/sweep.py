@@ -0,0 +1,179 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+from collections import namedtuple
+from concurrent.futures import as_completed
+import itertools
+
+import umsg.mixins
+
+from vmtplanner import Plan
+from vmtplanner.pool import PlanPool
+
+
+
+SweepRow = namedtuple('SweepRow', [
+    'params',
+    'plan',
+    'state',
+    'result',
+    'script_duration',
+    'server_duration',
+    'error'
+])
+SweepRow.__doc__ = """Parameter sweep result row.
+
+Attributes:
+    params (dict): Axis name keyed parameter values of the variant.
+    plan (:py:class:`~vmtplanner.Plan`): Plan instance, or ``None`` if the plan
+        could not be created.
+    state (:py:class:`~vmtplanner.MarketState`): Final market state, or ``None``.
+    result: Plan :meth:`~vmtplanner.Plan.run` return value.
+    script_duration (int): Plan script duration in seconds.
+    server_duration (int): Plan server side duration in seconds.
+    error (Exception): Exception raised by the plan, or ``None`` on success.
+"""
+
+
+class ParameterSweep(umsg.mixins.LoggingMixin):
+    """Plan parameter sweep.
+
+    Runs a plan for every combination of values along the sweep axes. Each axis
+    applies its value to a specification derived from the base specification
+    (see :meth:`~vmtplanner.PlanSpec.derive`), with a function taking the
+    :py:class:`~vmtplanner.PlanSpec` and the value, typically a
+    :py:class:`~vmtplanner.PlanSpec` method call. Variants are run with bounded
+    concurrency by a :py:class:`~vmtplanner.pool.PlanPool`, each with its own
+    shallow copy of the connection.
+
+    Args:
+        connection (:py:class:`~vmtconnect.Connection`): Connection to run
+            plans with.
+        spec (:py:class:`~vmtplanner.PlanSpec`): Base plan specification.
+        max_markets (int, optional): Maximum number of plan markets running
+            concurrently. (default: ``4``)
+        plan_class (class, optional): :py:class:`~vmtplanner.Plan` class used
+            for variants. (default: :py:class:`~vmtplanner.Plan`)
+        cleanup (bool, optional): If ``True``, each plan market and scenario is
+            removed once the plan finishes. (default: ``False``)
+        poller (:py:class:`~vmtplanner.pool.PlanPoller`, optional): Shared
+            status poller for all variants.
+        **kwargs: Additional plan class arguments.
+
+    Example:
+        .. code-block:: python
+
+           sweep = ParameterSweep(vmt, spec, max_markets=6)
+           sweep.axis('vms', [10, 20, 40], lambda s, v: s.add_template(tpl, count=v))
+           sweep.axis('util', [10, 25], lambda s, v: s.change_utilization(group, v))
+           sweep.axis('center', [60, 70], lambda s, v: s.set(center=v, diameter=10))
+
+           for row in sweep.run():
+               print(row.params, row.state, row.plan.unplaced_entities)
+    """
+    def __init__(self, connection, spec, max_markets=4, plan_class=Plan,
+                 cleanup=False, poller=None, **kwargs):
+        super().__init__()
+        self._vmt = connection
+        self.spec = spec
+        self.max_markets = max_markets
+        self.plan_class = plan_class
+        self.cleanup = cleanup
+        self.poller = poller
+        self.kwargs = kwargs
+        self.__axes = {}
+
+    def __len__(self):
+        res = 1
+
+        for values, _ in self.__axes.values():
+            res *= len(values)
+
+        return res if self.__axes else 0
+
+    def axis(self, name, values, apply):
+        """Adds a sweep axis.
+
+        Args:
+            name (str): Axis name, used as the parameter key in result rows.
+            values (iterable): Values to sweep.
+            apply (callable): Function called with the variant
+                :py:class:`~vmtplanner.PlanSpec` and a value, to apply it.
+
+        Returns:
+            :py:class:`ParameterSweep`: The sweep, for chaining.
+        """
+        self.__axes[name] = (list(values), apply)
+
+        return self
+
+    def variants(self):
+        """Yields the parameters of each variant.
+
+        Yields:
+            dict: Axis name keyed parameter values.
+        """
+        if not self.__axes:
+            return
+
+        names = list(self.__axes)
+
+        for values in itertools.product(*(self.__axes[x][0] for x in names)):
+            yield dict(zip(names, values))
+
+    def variant_spec(self, params):
+        """Returns the specification of a variant.
+
+        Args:
+            params (dict): Axis name keyed parameter values.
+
+        Returns:
+            :py:class:`~vmtplanner.PlanSpec`: Variant specification.
+        """
+        spec = self.spec.derive()
+
+        for name, value in params.items():
+            self.__axes[name][1](spec, value)
+
+        return spec
+
+    def run(self):
+        """Runs all variants.
+
+        Stopping iteration early cancels variants which have not started.
+
+        Yields:
+            :py:class:`SweepRow`: Variant results in completion order.
+        """
+        with PlanPool(max_markets=self.max_markets, plan_class=self.plan_class,
+                      cleanup=self.cleanup, poller=self.poller) as pool:
+            futures = {}
+
+            for params in self.variants():
+                f = pool.submit(self._vmt, self.variant_spec(params), **self.kwargs)
+                futures[f] = params
+
+            self.log(f'Sweeping {len(futures)} variants', level='debug')
+
+            try:
+                for f in as_completed(futures):
+                    res = f.result()
+
+                    yield SweepRow(futures[f], res.plan, res.state, res.result,
+                                   res.script_duration, res.server_duration,
+                                   res.error)
+            finally:
+                for f in futures:
+                    f.cancel()
@@ -0,0 +1,265 @@
+# Copyright 2020 Turbonomic, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# libraries
+
+from collections import deque
+import copy
+import threading
+import time
+
+import umsg.mixins
+
+from vmtplanner import Plan
+
+
+
+class _Template:
+    __slots__ = ['spec', 'ready']
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.ready = deque()
+
+
+class WarmPool(umsg.mixins.LoggingMixin):
+    """Pre-created plan scenario pool.
+
+    Keeps a number of scenarios created ahead of time for each registered base
+    specification, so that on-demand plans skip scenario creation, and the scope
+    lookups it may require, before the market is started. A background thread
+    replaces scenarios as they are handed out.
+
+    Plan markets are started by the server as soon as they are created, so only
+    scenarios are pre-created. Markets are created when the plan is run.
+
+    Args:
+        connection (:py:class:`~vmtconnect.Connection`): Connection to create
+            scenarios with.
+        size (int, optional): Number of ready scenarios kept per specification.
+            (default: ``2``)
+        ttl (int, optional): Seconds a ready scenario may be handed out before
+            it is replaced, 0 = unlimited. (default: ``0``)
+        plan_class (class, optional): :py:class:`~vmtplanner.Plan` class used
+            for handed out plans. (default: :py:class:`~vmtplanner.Plan`)
+
+    Example:
+        .. code-block:: python
+
+           pool = WarmPool(vmt, size=3)
+           pool.add('add-vms', spec)
+           pool.start()
+
+           # on demand
+           plan = pool.acquire('add-vms', lambda s: s.add_template(tpl, count=10))
+           plan.run()
+    """
+    def __init__(self, connection, size=2, ttl=0, plan_class=Plan):
+        super().__init__()
+        self._vmt = connection
+        self.size = size
+        self.ttl = ttl
+        self.plan_class = plan_class
+        self.__templates = {}
+        self.__cond = threading.Condition()
+        self.__thread = None
+        self.__stopped = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def __create(self, conn, template):
+        plan = self.plan_class(conn, template.spec.derive())
+        plan._init_scenario()
+
+        return plan.scenario_id, plan.scenario_name, time.monotonic(), plan._scenario_json
+
+    def __expired(self, item):
+        return self.ttl > 0 and time.monotonic() - item[2] > self.ttl
+
+    def __needed(self):
+        # next template short of ready scenarios
+        for key, t in self.__templates.items():
+            if len(t.ready) < self.size:
+                return key, t
+
+        return None, None
+
+    def __loop(self):
+        conn = copy.copy(self._vmt)
+
+        while True:
+            with self.__cond:
+                key, template = self.__needed()
+
+                while not self.__stopped and template is None:
+                    self.__cond.wait()
+                    key, template = self.__needed()
+
+                if self.__stopped:
+                    return
+
+            try:
+                item = self.__create(conn, template)
+            except Exception as e:                                             # pylint: disable=W0703
+                self.log(f'Unable to create warm scenario for [{key}]: {e}', level='warn')
+
+                with self.__cond:
+                    self.__cond.wait(30)
+
+                continue
+
+            with self.__cond:
+                if self.__templates.get(key) is template:
+                    template.ready.append(item)
+                    item = None
+
+            # template removed meanwhile
+            if item is not None:
+                self.__delete(conn, item[0])
+
+    def __delete(self, conn, uuid):
+        try:
+            conn.del_scenario(uuid)
+        except Exception as e:                                                 # pylint: disable=W0703
+            self.log(f'Unable to remove warm scenario [{uuid}]: {e}', level='warn')
+
+    def add(self, key, spec):
+        """Registers a base specification.
+
+        Args:
+            key (str): Name to acquire plans of this specification by.
+            spec (:py:class:`~vmtplanner.PlanSpec`): Base specification.
+        """
+        with self.__cond:
+            self.__templates[key] = _Template(copy.deepcopy(spec))
+            self.__cond.notify_all()
+
+    def remove(self, key):
+        """Unregisters a base specification, and removes its ready scenarios."""
+        with self.__cond:
+            template = self.__templates.pop(key)
+            ready = list(template.ready)
+            template.ready.clear()
+
+        for x in ready:
+            self.__delete(self._vmt, x[0])
+
+    def ready(self, key):
+        """Returns the number of ready scenarios for a specification."""
+        with self.__cond:
+            return len(self.__templates[key].ready)
+
+    def start(self):
+        """Starts replenishing the pool in the background."""
+        with self.__cond:
+            self.__stopped = False
+
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__loop, daemon=True)
+                self.__thread.start()
+
+    def fill(self):
+        """Fills the pool in the calling thread."""
+        while True:
+            with self.__cond:
+                key, template = self.__needed()
+
+            if template is None:
+                return
+
+            item = self.__create(self._vmt, template)
+
+            with self.__cond:
+                if self.__templates.get(key) is template:
+                    template.ready.append(item)
+                    item = None
+
+            # template removed meanwhile
+            if item is not None:
+                self.__delete(self._vmt, item[0])
+
+    def acquire(self, key, customize=None, **kwargs):
+        """Returns a plan using a ready scenario.
+
+        If no scenario is ready, the plan creates its own when run.
+
+        Args:
+            key (str): Specification name.
+            customize (callable, optional): Called with a specification derived
+                from the base specification, to apply last-mile changes before
+                the plan is handed out. The ready scenario is updated on the
+                server when the plan is run, only if the changes alter it.
+            **kwargs: Additional plan class arguments.
+
+        Returns:
+            :py:class:`~vmtplanner.Plan`: Plan ready to run.
+        """
+        expired = []
+
+        with self.__cond:
+            template = self.__templates[key]
+            item = None
+
+            while template.ready:
+                item = template.ready.popleft()
+
+                if not self.__expired(item):
+                    break
+
+                expired.append(item[0])
+                item = None
+
+            self.__cond.notify_all()
+
+        # removed outside the lock, so as not to block other callers
+        for x in expired:
+            self.__delete(self._vmt, x)
+
+        spec = template.spec.derive()
+
+        if customize is not None:
+            customize(spec)
+
+        plan = self.plan_class(self._vmt, spec, **kwargs)
+
+        if item is None:
+            self.log(f'No warm scenario ready for [{key}]', level='debug')
+            return plan
+
+        # the scenario is updated when run, if the spec was customized
+        plan._use_scenario(item[0], item[1], item[3])
+
+        return plan
+
+    def shutdown(self, clear=True):
+        """Stops replenishing the pool.
+
+        Args:
+            clear (bool, optional): If ``True``, ready scenarios are removed
+                from the server. (default: ``True``)
+        """
+        with self.__cond:
+            self.__stopped = True
+            self.__cond.notify_all()
+            thread, self.__thread = self.__thread, None
+
+        if thread is not None:
+            thread.join()
+
+        if clear:
+            for key in list(self.__templates):
+                self.remove(key)